@@ -0,0 +1,51 @@
+import logging
+import os
+import pickle
+
+# Persistência dos caches em disco (.cache/)
+# Os arquivos são gravados em um temporário e renomeados no fim, então outro processo
+# nunca lê um cache pela metade. Falhas de leitura/gravação não interrompem o app: o
+# cache é apenas descartado (leitura) ou não atualizado (gravação), com aviso no log.
+logger = logging.getLogger(__name__)
+
+PASTA_CACHE = '.cache'
+
+def origem_arquivo(caminho):
+    """Identifica a versão de um arquivo de origem (tamanho, mtime) para invalidar caches derivados dele."""
+    info = os.stat(caminho)
+    return (info.st_size, info.st_mtime_ns)
+
+def gravar_atomico(caminho, escrever):
+    """Chama escrever(caminho_temporario) e move o resultado para `caminho`. Devolve True se gravou."""
+    temp = f"{caminho}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        escrever(temp)
+        os.replace(temp, caminho)
+        return True
+    except Exception as e:
+        logger.warning("Erro ao gravar cache %s: %s", caminho, e)
+        if os.path.exists(temp):
+            os.remove(temp)
+        return False
+
+def ler_pickle(caminho, origem=None):
+    """Dados gravados por gravar_pickle, ou None se o arquivo não existir, não puder ser lido ou a origem mudou."""
+    try:
+        with open(caminho, 'rb') as f:
+            registro = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Erro ao ler cache %s: %s", caminho, e)
+        return None
+    if not isinstance(registro, dict) or registro.get('origem') != origem:
+        return None
+    return registro.get('dados')
+
+def gravar_pickle(caminho, dados, origem=None):
+    """Grava `dados` junto com a `origem` que os gerou (comparada por ler_pickle)."""
+    def escrever(temp):
+        with open(temp, 'wb') as f:
+            pickle.dump({'origem': origem, 'dados': dados}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return gravar_atomico(caminho, escrever)
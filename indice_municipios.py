@@ -0,0 +1,90 @@
+import os
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from cache_disco import PASTA_CACHE, origem_arquivo, ler_pickle, gravar_pickle
+
+# Índice de municípios (Município -> UF), montado uma única vez por processo.
+# As chaves são normalizadas (sem acento, minúsculas, espaços simples) pela mesma função
+# usada na busca, então 'São João' encontra o 'Sao Joao' do CSV. Para homônimos vale a
+# última UF do CSV (como no antigo dict(zip(...))); uma UF válida digitada na entrada
+# é sempre mantida. O índice é persistido para evitar o parse do CSV a cada início.
+ARQUIVO_MUNICIPIOS = 'municipios.csv'
+ARQUIVO_INDICE = os.path.join(PASTA_CACHE, 'municipios.pkl')
+VERSAO_INDICE = 2  # Incrementar quando a estrutura do índice mudar
+
+UFS = pa.array([
+    'AC', 'AL', 'AM', 'AP', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MG', 'MS', 'MT', 'PA',
+    'PB', 'PE', 'PI', 'PR', 'RJ', 'RN', 'RO', 'RR', 'RS', 'SC', 'SE', 'SP', 'TO'
+])
+
+# Acentos removidos na chave de busca (os nomes do CSV não têm acento)
+ACENTOS = {
+    '[áàâãäå]': 'a',
+    '[éèêë]': 'e',
+    '[íìîï]': 'i',
+    '[óòôõö]': 'o',
+    '[úùûü]': 'u',
+    'ç': 'c',
+    'ñ': 'n',
+    '[ýÿ]': 'y'
+}
+
+_indice = None
+_trava_indice = threading.Lock()
+
+def chave_busca(nomes):
+    """Chave de busca de um array Arrow de nomes: sem acentos, minúscula e com espaços simples."""
+    chaves = pc.utf8_lower(nomes)
+    for padrao, letra in ACENTOS.items():
+        chaves = pc.replace_substring_regex(chaves, padrao, letra)
+    return pc.replace_substring_regex(pc.utf8_trim_whitespace(chaves), r'\s+', ' ')
+
+def montar_indice(caminho_csv=ARQUIVO_MUNICIPIOS):
+    """Lê o CSV e monta (chaves, ufs): arrays Arrow alinhados, com uma chave por município."""
+    df_muni = pd.read_csv(caminho_csv, dtype=str)
+    chaves = chave_busca(pa.array(df_muni['Município'], type=pa.string()))
+    unicos = pd.DataFrame({'chave': chaves.to_pandas(), 'uf': df_muni['UF']}).drop_duplicates('chave', keep='last')
+    return pa.array(unicos['chave'], type=pa.string()), pa.array(unicos['uf'], type=pa.string())
+
+def carregar_indice(caminho_csv=ARQUIVO_MUNICIPIOS, caminho_indice=ARQUIVO_INDICE):
+    """Carrega o índice persistido se ainda corresponder ao CSV; senão remonta e grava."""
+    origem = (origem_arquivo(caminho_csv), VERSAO_INDICE)
+    indice = ler_pickle(caminho_indice, origem)
+    if indice is None:
+        indice = montar_indice(caminho_csv)
+        gravar_pickle(caminho_indice, indice, origem)
+    return indice
+
+def obter_indice():
+    """Índice do processo (carregado na primeira chamada)."""
+    global _indice
+    if _indice is None:
+        with _trava_indice:
+            if _indice is None:
+                _indice = carregar_indice()
+    return _indice
+
+def tratar_naturalidade(naturalidade, indice):
+    """
+    Naturalidade -> 'Município(UF)' sobre a coluna inteira. Uma UF válida entre parênteses
+    fica como digitada; sem ela, a UF vem do índice quando o município é encontrado, e
+    senão fica só o município. Com indice=None não há busca. Nulos viram "".
+    Naturalidades se repetem muito, então o tratamento é feito só nos valores distintos.
+    """
+    codificado = pc.dictionary_encode(pa.array(naturalidade.astype('string'), type=pa.string(), from_pandas=True))
+    distintos = codificado.dictionary
+
+    nome = pc.utf8_trim_whitespace(pc.list_element(pc.split_pattern(distintos, '(', max_splits=1), 0))
+    uf_informada = pc.utf8_upper(pc.utf8_trim_whitespace(
+        pc.struct_field(pc.extract_regex(distintos, r'\((?P<uf>[^)]*)'), [0])
+    ))
+    uf = pc.if_else(pc.is_in(uf_informada, value_set=UFS), uf_informada, pa.scalar(None, pa.string()))
+    if indice is not None:
+        chaves, ufs = indice
+        uf = pc.coalesce(uf, pc.take(ufs, pc.index_in(chave_busca(nome), value_set=chaves)))
+
+    formatado = pc.if_else(pc.is_null(uf), nome, pc.binary_join_element_wise(nome, '(', uf, ')', ''))
+    resultado = pc.fill_null(pc.take(formatado, codificado.indices), '')
+    return pd.Series(resultado.to_numpy(zero_copy_only=False), index=naturalidade.index)
@@ -0,0 +1,318 @@
+import io
+import os
+import logging
+import hashlib
+import zipfile
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+from openpyxl import load_workbook
+from cache_disco import PASTA_CACHE as PASTA_CACHE_BASE, gravar_atomico
+
+# Planilhas Excel são lidas pelo calamine (leitor em Rust, engine do pandas), bem mais
+# rápido que o openpyxl. Sem o python-calamine instalado, o .xlsx volta a ser lido pelo
+# openpyxl em modo somente leitura e o .xls pelo xlrd.
+try:
+    import python_calamine  # noqa: F401
+    MOTOR_EXCEL = 'calamine'
+except ImportError:
+    MOTOR_EXCEL = None
+
+logger = logging.getLogger(__name__)
+
+# Colunas do SUAP efetivamente usadas no tratamento e na geração do livro.
+# As demais colunas da exportação são descartadas já na leitura.
+COLUNAS_SUAP = [
+    'Matrícula',
+    'CPF',
+    'Nome',
+    'Data de Nascimento',
+    'Sexo',
+    'Nome da Mãe',
+    'Nome do Pai',
+    'Naturalidade',
+    'Nacionalidade',
+    'Etnia/Raça',
+    'Deficiência',
+    'Superdotação',
+    'Transtorno',
+    'Situação no Ano Selecionado',
+    'Data do Último Procedimento',
+    'Data de Matrícula',
+    'Descrição do Curso',
+    'Período no Ano Selecionado',
+    'Turma no Ano Selecionado',
+    'Matriz',
+    'Curso',
+]
+
+# Colunas de data: ficam fora do dtype=str. No Excel, células de data forçadas para str
+# viram '2010-05-03 00:00:00' (ISO), que o parser com dayfirst depois lê errado; por isso
+# elas são convertidas para o formato do SUAP (DD/MM/AAAA) na leitura (ver datas_como_texto).
+COLUNAS_DATA_SUAP = ['Data de Nascimento', 'Data do Último Procedimento', 'Data de Matrícula']
+
+# Tipos explícitos: as demais colunas são lidas como texto. Sem isso, Matrícula e CPF
+# (com nulos) seriam inferidos como float e voltariam como '2024123456.0'.
+TIPOS_SUAP = {col: str for col in COLUNAS_SUAP if col not in COLUNAS_DATA_SUAP}
+
+def coluna_necessaria(col):
+    """Filtro de usecols: mantém apenas as colunas de COLUNAS_SUAP."""
+    return col in COLUNAS_SUAP
+
+# Leitura em blocos: CSVs acima deste tamanho são processados bloco a bloco
+TAMANHO_MIN_BLOCOS = 5 * 1024 * 1024  # 5 MB
+LINHAS_POR_BLOCO = 10000
+
+def coluna_texto_arrow(serie):
+    """Converte a coluna para um array Arrow de texto (valores não textuais via str, nulos preservados)."""
+    try:
+        return pa.array(serie, type=pa.string(), from_pandas=True)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        return pa.array(serie.where(serie.isna(), serie.astype(str)), type=pa.string(), from_pandas=True)
+
+def valor_celula_texto(valor):
+    """
+    Converte o valor de uma célula do Excel para texto, como o read_excel(dtype=str) faria,
+    exceto datas, que saem no formato do SUAP (DD/MM/AAAA).
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, (datetime, date)):
+        return valor.strftime('%d/%m/%Y')
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor)
+
+def datas_como_texto(df):
+    """Colunas de data lidas do Excel (datetime ou misturadas com texto) -> texto DD/MM/AAAA."""
+    for col in COLUNAS_DATA_SUAP:
+        if col in df.columns:
+            valores = df[col].astype(object)
+            df[col] = valores.map(valor_celula_texto, na_action='ignore').where(valores.notna(), np.nan)
+    return df
+
+def nulos_como_nan(df):
+    """Nulos das colunas de texto como NaN, como na leitura do CSV (o openpyxl e o Parquet devolvem None)."""
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+def ler_xlsx_streaming(conteudo):
+    """
+    Lê um .xlsx em modo somente leitura (linha a linha, sem carregar estilos),
+    projetando apenas as colunas de COLUNAS_SUAP.
+    """
+    wb = load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, ())
+
+        # Posição de cada coluna necessária (primeira ocorrência, como no pandas)
+        indices = {}
+        for i, nome in enumerate(cabecalho):
+            nome = valor_celula_texto(nome)
+            if coluna_necessaria(nome) and nome not in indices:
+                indices[nome] = i
+        colunas = list(indices)
+        posicoes = list(indices.values())
+
+        dados = []
+        for linha in linhas:
+            valores = [valor_celula_texto(linha[i]) if i < len(linha) else None for i in posicoes]
+            # Linhas totalmente vazias (comuns ao final da planilha) são ignoradas
+            if any(v is not None for v in valores):
+                dados.append(valores)
+    finally:
+        wb.close()
+
+    return nulos_como_nan(pd.DataFrame(dados, columns=colunas, dtype=object))
+
+def ler_excel_calamine(conteudo):
+    """Lê .xlsx/.xls com o calamine, projetando as colunas de COLUNAS_SUAP (mesmo resultado do leitor openpyxl)."""
+    df = pd.read_excel(io.BytesIO(conteudo), engine='calamine', usecols=coluna_necessaria, dtype=TIPOS_SUAP)
+    # Linhas totalmente vazias (comuns ao final da planilha) são ignoradas
+    return datas_como_texto(df.dropna(how='all').reset_index(drop=True))
+
+def ler_arquivo(conteudo, nome_arquivo):
+    """Lê os bytes do upload (apenas as colunas necessárias, já tipadas) de acordo com a extensão."""
+    if nome_arquivo.endswith('.csv'):
+        return pd.read_csv(io.BytesIO(conteudo), usecols=coluna_necessaria, dtype=TIPOS_SUAP)
+    if MOTOR_EXCEL == 'calamine':
+        return ler_excel_calamine(conteudo)
+    if nome_arquivo.endswith('.xlsx'):
+        return ler_xlsx_streaming(conteudo)
+    return datas_como_texto(pd.read_excel(io.BytesIO(conteudo), usecols=coluna_necessaria, dtype=TIPOS_SUAP))
+
+def ler_csv_em_blocos(conteudo, tratar, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """
+    Lê um CSV em blocos de tamanho fixo, aplicando `tratar` a cada bloco.
+    Apenas as colunas de COLUNAS_SUAP são lidas e só as linhas que sobrevivem ao
+    tratamento são mantidas, então o pico de memória depende do bloco e não do arquivo.
+    """
+    leitor = pd.read_csv(
+        io.BytesIO(conteudo),
+        usecols=coluna_necessaria,
+        dtype=TIPOS_SUAP,
+        chunksize=linhas_por_bloco,
+    )
+    blocos = [tratar(bloco) for bloco in leitor]
+    if not blocos:
+        return tratar(pd.DataFrame(columns=COLUNAS_SUAP))
+    return concatenar_blocos(blocos)
+
+def concatenar_blocos(blocos):
+    """
+    Concatena os blocos tratados. Colunas category têm categorias diferentes em cada
+    bloco; elas são unificadas antes para o resultado continuar categórico (sem virar object).
+    """
+    for col in blocos[0].columns:
+        if isinstance(blocos[0][col].dtype, pd.CategoricalDtype):
+            uniao = union_categoricals([b[col] for b in blocos], sort_categories=True).categories
+            for b in blocos:
+                b[col] = b[col].cat.set_categories(uniao)
+    resultado = pd.concat(blocos, ignore_index=True)
+    metricas = somar_metricas([b.attrs.get('metricas_tratamento') for b in blocos])
+    if metricas:
+        resultado.attrs['metricas_tratamento'] = metricas
+    resultado.attrs['avisos_tratamento'] = somar_avisos([b.attrs.get('avisos_tratamento', {}) for b in blocos])
+    return resultado
+
+def acumular_aviso(avisos, mensagem, quantidade=None):
+    """Inclui o aviso em {mensagem: quantidade ou None}; quantidades da mesma mensagem são somadas."""
+    if quantidade is None:
+        avisos.setdefault(mensagem, None)
+    else:
+        avisos[mensagem] = (avisos.get(mensagem) or 0) + quantidade
+
+def somar_avisos(avisos_blocos):
+    """Une os avisos dos blocos, na ordem em que apareceram."""
+    total = {}
+    for avisos in avisos_blocos:
+        for mensagem, quantidade in avisos.items():
+            acumular_aviso(total, mensagem, quantidade)
+    return total
+
+def somar_metricas(metricas_blocos):
+    """Soma tempo e linhas de cada etapa do tratamento entre os blocos (mesma ordem de etapas)."""
+    if not metricas_blocos or any(m is None for m in metricas_blocos):
+        return None
+    total = [dict(m) for m in metricas_blocos[0]]
+    for metricas in metricas_blocos[1:]:
+        for registro, bloco in zip(total, metricas):
+            registro['segundos'] += bloco['segundos']
+            registro['linhas'] += bloco['linhas']
+    return total
+
+def hash_conteudo(conteudo):
+    """Retorna o SHA-256 (hex) dos bytes do arquivo enviado."""
+    return hashlib.sha256(conteudo).hexdigest()
+
+# Cache em disco (Parquet) das planilhas já convertidas
+# Reenvios do mesmo arquivo (nova sessão, refresh, outro operador) pulam a leitura do Excel.
+# A versão entra no nome do arquivo para invalidar o cache se COLUNAS_SUAP ou a conversão
+# das células mudar (VERSAO_LEITURA deve ser incrementada nesse caso).
+PASTA_CACHE = os.environ.get('LIVRO_CACHE_DIR', os.path.join(PASTA_CACHE_BASE, 'uploads'))
+TAMANHO_MAX_CACHE = 200 * 1024 * 1024  # 200 MB
+VERSAO_LEITURA = 2  # 2: datas do Excel como DD/MM/AAAA
+VERSAO_CACHE = hash_conteudo(f"{'|'.join(COLUNAS_SUAP)}|{VERSAO_LEITURA}".encode('utf-8'))[:8]
+
+def caminho_cache(chave):
+    return os.path.join(PASTA_CACHE, f"{chave}_{VERSAO_CACHE}.parquet")
+
+def ler_cache(chave):
+    """Retorna o DataFrame em cache para a chave, ou None se não existir/não puder ser lido."""
+    caminho = caminho_cache(chave)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        df = pd.read_parquet(caminho)
+        os.utime(caminho)  # Marca como usado recentemente (ordem de despejo)
+        return nulos_como_nan(df)
+    except Exception as e:
+        logger.warning("Erro ao ler cache %s: %s", caminho, e)
+        return None
+
+def gravar_cache(chave, df):
+    """Grava o DataFrame no cache e despeja as entradas mais antigas acima do limite de tamanho."""
+    if gravar_atomico(caminho_cache(chave), lambda temp: df.to_parquet(temp, index=False)):
+        limpar_cache()
+
+def limpar_cache(tamanho_max=TAMANHO_MAX_CACHE):
+    """Remove as entradas menos usadas recentemente até o cache caber em tamanho_max."""
+    entradas = []
+    for nome in os.listdir(PASTA_CACHE):
+        if nome.endswith('.parquet'):
+            caminho = os.path.join(PASTA_CACHE, nome)
+            try:
+                info = os.stat(caminho)
+            except OSError:
+                continue  # Removido por outro processo
+            entradas.append((info.st_mtime, info.st_size, caminho))
+
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    for _, tamanho, caminho in sorted(entradas):
+        if total <= tamanho_max:
+            break
+        try:
+            os.remove(caminho)
+            total -= tamanho
+        except OSError as e:
+            logger.warning("Erro ao remover %s do cache: %s", caminho, e)
+
+def ler_arquivo_com_cache(conteudo, nome_arquivo, chave):
+    """Lê o upload; planilhas Excel passam pelo cache em Parquet."""
+    if nome_arquivo.endswith('.csv'):
+        return ler_arquivo(conteudo, nome_arquivo)
+
+    df = ler_cache(chave)
+    if df is None:
+        df = ler_arquivo(conteudo, nome_arquivo)
+        gravar_cache(chave, df)
+    return df
+
+def carregar_arquivo(conteudo, nome_arquivo, tratar, chave=None):
+    """Lê e trata o upload, usando a leitura em blocos para CSVs grandes."""
+    if nome_arquivo.endswith('.csv') and len(conteudo) >= TAMANHO_MIN_BLOCOS:
+        return ler_csv_em_blocos(conteudo, tratar)
+    if chave is None:
+        chave = hash_conteudo(conteudo)
+    return tratar(ler_arquivo_com_cache(conteudo, nome_arquivo, chave))
+
+# Lote (ZIP): exportações do SUAP de várias unidades + manifesto das escolas
+# O manifesto é um CSV com uma linha por arquivo do ZIP e os dados da unidade escolar.
+NOME_MANIFESTO = 'escolas.csv'
+COLUNAS_MANIFESTO = ['arquivo', 'nome', 'inep']  # Obrigatórias
+EXTENSOES_SUAP = ('.csv', '.xlsx', '.xls')
+
+def iterar_lote_zip(conteudo):
+    """
+    Percorre o ZIP do lote, retornando (linha do manifesto, nome do membro, bytes) por escola.
+    Os arquivos são extraídos um de cada vez; bytes é None se o arquivo não estiver no ZIP.
+    """
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as zf:
+        # Indexar pelo nome do arquivo (ignorando pastas dentro do ZIP)
+        membros = {}
+        for nome in zf.namelist():
+            if not nome.endswith('/'):
+                membros.setdefault(os.path.basename(nome), nome)
+
+        if NOME_MANIFESTO not in membros:
+            raise ValueError(f"O ZIP não contém o manifesto '{NOME_MANIFESTO}'.")
+
+        manifesto = pd.read_csv(io.BytesIO(zf.read(membros[NOME_MANIFESTO])), dtype=str).fillna('')
+        manifesto.columns = [c.strip().lower() for c in manifesto.columns]
+        faltantes = [c for c in COLUNAS_MANIFESTO if c not in manifesto.columns]
+        if faltantes:
+            raise ValueError(f"Colunas obrigatórias ausentes no manifesto: {', '.join(faltantes)}")
+
+        for linha in manifesto.to_dict('records'):
+            linha = {k: v.strip() for k, v in linha.items()}
+            nome_arquivo = os.path.basename(linha['arquivo'])
+            membro = membros.get(nome_arquivo)
+            if membro is None or not nome_arquivo.lower().endswith(EXTENSOES_SUAP):
+                yield linha, nome_arquivo, None
+            else:
+                yield linha, nome_arquivo, zf.read(membro)
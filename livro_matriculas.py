@@ -2,6 +2,15 @@ import streamlit as st
 import pandas as pd
 from datetime import date, datetime
 import re
+import os
+import tempfile
+import time
+import zipfile
+import logging
+from ingestao import carregar_arquivo, hash_conteudo, iterar_lote_zip
+from tratamento import tratar_dados, textos_avisos
+
+logger = logging.getLogger(__name__)
 
 # Configuração da página
 st.set_page_config(
@@ -195,180 +204,30 @@ def validar_dados():
     if not telefone_input: erros.append("Telefone é obrigatório")
     return erros
 
-# Processamento de Dados
-@st.cache_data
-def carregar_depara():
-    try:
-        return pd.read_csv("DEPARA.csv")
-    except Exception as e:
-        st.error(f"Erro ao carregar DEPARA.csv: {e}")
-        return None
-
-def tratar_dados(df, ano_letivo_ref, data_censo_ref):
-    # 0. Filtrar matrículas cujo ano inicia com valor superior ao ano letivo selecionado
-    if "Matrícula" in df.columns:
-        def filtro_ano_matricula(mat):
-            if pd.isnull(mat): return True
-            mat_str = str(mat).replace('.0', '').strip()
-            if len(mat_str) >= 4 and mat_str[:4].isdigit():
-                ano_mat = int(mat_str[:4])
-                if ano_mat > int(ano_letivo_ref):
-                    return False
-            return True
-        df = df[df["Matrícula"].apply(filtro_ano_matricula)].reset_index(drop=True)
-
-    # 1. Converter datas para DD/MM/yyyy e criar temp para cálculos
-    colunas_datas = ["Data de Matrícula", "Data do Último Procedimento"]
-    
-    # Temp para Data de Matrícula
-    if "Data de Matrícula" in df.columns:
-        df["_dt_matricula_temp"] = pd.to_datetime(df["Data de Matrícula"], errors='coerce', dayfirst=True)
-
-    for col in colunas_datas:
-        if col in df.columns:
-            # Garante dayfirst=True para evitar warnings e erros com datas DD/MM
-            df[col] = pd.to_datetime(df[col], errors='coerce', dayfirst=True).dt.strftime('%d/%m/%Y')
-    
-    # 2. Calcular Idade em 31/03 do Ano Letivo
-    if "Data de Nascimento" in df.columns:
-        df["Data de Nascimento"] = pd.to_datetime(df["Data de Nascimento"], errors='coerce', dayfirst=True)
-        
-        def calcular_idade(nascimento, ano_ref):
-            if pd.isnull(nascimento): return None
-            data_ref = date(int(ano_ref), 3, 31)
-            idade = data_ref.year - nascimento.year - ((data_ref.month, data_ref.day) < (nascimento.month, nascimento.day))
-            return idade
-            
-        df[f"Idade em 31/03/{ano_letivo_ref}"] = df["Data de Nascimento"].apply(lambda x: calcular_idade(x, ano_letivo_ref))
-        
-        # Formatar Nascimento para visualização
-        df["Data de Nascimento"] = df["Data de Nascimento"].dt.strftime('%d/%m/%Y')
-
-    # 3. Aplicar DE-PARA (Grupo/Ano/Fase e Ordenador)
-    df_depara = carregar_depara()
-    if df_depara is not None:
-        # Chaves para o merge
-        chaves = ["Descrição do Curso", "Período no Ano Selecionado"]
-        
-        # Verificar se as chaves existem no dataframe carregado
-        if all(key in df.columns for key in chaves):
-            # Garantir tipos compatíveis para merge (convertendo para string se necessário, mas geralmente int/str combinam se limpos)
-            # O DEPARA parece ter Período como int. Vamos garantir que no df também seja ou ambos str.
-            # Convertendo ambos para string para segurança
-            df["Descrição do Curso"] = df["Descrição do Curso"].astype(str)
-            df["Período no Ano Selecionado"] = df["Período no Ano Selecionado"].astype(str)
-            
-            df_depara["Descrição do Curso"] = df_depara["Descrição do Curso"].astype(str)
-            df_depara["Período no Ano Selecionado"] = df_depara["Período no Ano Selecionado"].astype(str)
-
-            # Merge Left para manter dados originais
-            df = pd.merge(df, df_depara, on=chaves, how="left")
-        else:
-            st.warning("Colunas 'Descrição do Curso' e 'Período no Ano Selecionado' não encontradas para aplicação do DE-PARA.")
-
-    # 4. Criar Coluna Consolidada de Necessidades Especiais
-    # Colunas origem: 'Deficiência', 'Superdotação', 'Transtorno'
-    cols_nec = ['Deficiência', 'Superdotação', 'Transtorno']
-    
-    # 5. Limpeza e Consulta de Naturalidade (Município -> Município(UF))
-    if 'Naturalidade' in df.columns:
-        # Carregar municípios
-        try:
-            df_muni = pd.read_csv('municipios.csv')
-            # Criar dicionário {Município: UF}
-            # Atenção: Municípios homônimos em UFs diferentes (ex: Bom Jesus) vão sobrescrever.
-            # O ideal seria ter UF na entrada, mas dada a regra de limpeza anterior, assumimos lookup direto.
-            dict_muni = dict(zip(df_muni['Município'], df_muni['UF']))
-        except Exception as e:
-            st.warning(f"Não foi possível carregar municipios.csv: {e}")
-            dict_muni = {}
-
-        def tratar_naturalidade(valor):
-            if pd.isnull(valor): return ""
-            # Limpeza inicial: Remover tudo após '(' e trim
-            nome_limpo = str(valor).split('(', 1)[0].strip()
-            
-            # Lookup
-            if nome_limpo in dict_muni:
-                uf = dict_muni[nome_limpo]
-                return f"{nome_limpo}({uf})"
-            return nome_limpo
-
-        df['Naturalidade'] = df['Naturalidade'].apply(tratar_naturalidade)
-
-    def consolidar_necessidades(row):
-        for col in cols_nec:
-            if col in row.index:
-                valor = row[col]
-                # Verifica se não é nulo e não é '-'
-                if pd.notna(valor) and str(valor).strip() != '-':
-                    return "Sim"
-        
-        return "-"
-
-    # Aplica linha a linha
-    df['Deficiência, TEA, Altas Habilidades ou Superdotação'] = df.apply(consolidar_necessidades, axis=1)
-
-    # Nova Lógica Condicional para 'Situação no Ano Selecionado' (Educação Infantil)
-    # Se "Descrição do Curso" == "Educação Infantil" AND "Situação no Ano Selecionado" == "Aprovado" -> "Sem Movimentação"
-    # Se "Descrição do Curso" == "Educação Infantil" AND "Situação no Ano Selecionado" == "Reprovado" -> "Ajuste de Idade"
-    
-    if 'Descrição do Curso' in df.columns and 'Situação no Ano Selecionado' in df.columns:
-        # Normalizar strings para comparação segura
-        df['Descrição do Curso'] = df['Descrição do Curso'].astype(str).str.strip()
-        df['Situação no Ano Selecionado'] = df['Situação no Ano Selecionado'].astype(str).str.strip()
-        
-        mask_infantil = df['Descrição do Curso'] == 'Educação Infantil'
-        mask_aprovado = df['Situação no Ano Selecionado'] == 'Aprovado'
-        mask_reprovado = df['Situação no Ano Selecionado'] == 'Reprovado'
-        
-        df.loc[mask_infantil & mask_aprovado, 'Situação no Ano Selecionado'] = 'Sem Movimentação'
-        df.loc[mask_infantil & mask_reprovado, 'Situação no Ano Selecionado'] = 'Ajuste de Idade'
-
-    # Substituição específica solicitada: "Aprovado com Progressão Parcial" -> "Aprovado com Prog. Parcial"
-    if 'Situação no Ano Selecionado' in df.columns:
-        df['Situação no Ano Selecionado'] = df['Situação no Ano Selecionado'].replace(
-            "Aprovado com Progressão Parcial", "Aprovado com Prog. Parcial"
-        )
-    
-    # 6. Lógica Condicional para 'Data da Situação'
-    # Mostrar data apenas se Situação for "Transferido" ou "Transf. Externa"
-    if 'Situação no Ano Selecionado' in df.columns:
-        # Limpar espaços em branco da coluna Situação
-        df['Situação no Ano Selecionado'] = df['Situação no Ano Selecionado'].astype(str).str.strip()
-        
-        if 'Data do Último Procedimento' in df.columns:
-            def tratar_data_situacao(row):
-                situacao = str(row.get('Situação no Ano Selecionado', '')).strip()
-                if situacao in ['Transferido', 'Transf. Externa']:
-                    data = row.get('Data do Último Procedimento', '')
-                    return data if pd.notna(data) else '-'
-                return '-'
-            
-            df['Data do Último Procedimento'] = df.apply(tratar_data_situacao, axis=1)
-        
-    # 7. Criar Coluna "Pós Censo"
-    # Preenchido com "Sim" se 'Data de Matrícula' (usando temp) for igual ou superior a 'Data de referência do Censo Escolar'
-    if "_dt_matricula_temp" in df.columns and data_censo_ref:
-        try:
-            # Garantir que data_censo_ref seja Timestamp para comparação
-            censo_ts = pd.Timestamp(data_censo_ref)
-            
-            df['Pós Censo'] = df['_dt_matricula_temp'].apply(
-                lambda x: "Sim" if pd.notnull(x) and x >= censo_ts else "-"
-            )
-        except Exception as e:
-            st.warning(f"Erro ao calcular Pós Censo: {e}")
-            df['Pós Censo'] = "-"
-            
-        # Remover coluna temporária
-        df.drop(columns=["_dt_matricula_temp"], inplace=True)
-    else:
-         df['Pós Censo'] = "-"
+# Processamento de Dados (tratamento em tratamento.py)
+def mostrar_avisos(df):
+    for aviso in textos_avisos(df):
+        st.warning(aviso)
+
+# Memoização do tratamento entre reruns do Streamlit
+# Qualquer widget alterado reexecuta o script inteiro; a chave é o hash do conteúdo
+# do upload + ano letivo + data do censo, então o arquivo só é reprocessado quando
+# um desses valores muda de fato. max_entries limita o cache (descarta o menos usado).
+@st.cache_data(max_entries=16, show_spinner=False)
+def carregar_e_tratar(chave_conteudo, nome_arquivo, ano_letivo_ref, data_censo_ref, _conteudo):
+    """Lê e trata o upload. O parâmetro _conteudo não entra no hash (a chave já o representa)."""
+    return carregar_arquivo(
+        _conteudo, nome_arquivo,
+        lambda df: tratar_dados(df, ano_letivo_ref, data_censo_ref, colunas_necessarias(ano_letivo_ref)),
+        chave=chave_conteudo
+    )
 
-    return df
+def carregar_upload(uploaded_file, ano_letivo_ref, data_censo_ref):
+    """Retorna o DataFrame tratado do upload, reaproveitando o cache quando possível."""
+    conteudo = uploaded_file.getvalue()
+    return carregar_e_tratar(hash_conteudo(conteudo), uploaded_file.name, ano_letivo_ref, data_censo_ref, conteudo)
 
-from pdf_generator import gerar_pdf_matricula, gerar_capa, gerar_termo_abertura, gerar_termo_encerramento
+from pdf_generator import gravar_pdf_matricula, gravar_documentos_encadernados, gerar_capa, gerar_termo_abertura, gerar_termo_encerramento, colunas_necessarias, campos_documento
 
 # Validação Reutilizável
 def validar_dados(dados):
@@ -396,6 +255,22 @@ def validar_dados(dados):
             
     return erros
 
+# Capa e termos dependem só de alguns campos da escola: gerados uma vez por conteúdo
+# e reaproveitados nos reruns (qualquer clique na página) em vez de refeitos a cada vez
+GERADORES_DOCUMENTOS = {
+    'capa': gerar_capa,
+    'abertura': gerar_termo_abertura,
+    'encerramento': gerar_termo_encerramento
+}
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def gerar_documento_escola(tipo, campos):
+    """PDF do documento `tipo` a partir dos pares (campo, valor) de campos_documento."""
+    return GERADORES_DOCUMENTOS[tipo](dict(campos))
+
+def documento_escola(tipo, dados_escola):
+    return gerar_documento_escola(tipo, campos_documento(tipo, dados_escola))
+
 def processar_arquivo_action(df, key_prefix, dados_escola):
     """Função chamada pelo callback do botão de processar"""
     # Validar
@@ -404,18 +279,32 @@ def processar_arquivo_action(df, key_prefix, dados_escola):
         st.session_state[f'erros_{key_prefix}'] = erros
         st.session_state[f'sucesso_{key_prefix}'] = False
     else:
-        st.session_state[f'erros_{key_prefix}'] = []
-        st.session_state[f'sucesso_{key_prefix}'] = True
-        
         # Gerar nome do arquivo conforme regras solicitadas
         if "EJA 2º SEM" in key_prefix:
             filename_pdf = f"livro_matricula{dados_escola['ano_letivo']}2SEM.pdf"
         else:
             filename_pdf = f"livro_matricula{dados_escola['ano_letivo']}.pdf"
         
-        # Gerar PDF
-        pdf_bytes = gerar_pdf_matricula(df, dados_escola, key_prefix)
-        st.session_state[f'pdf_bytes_{key_prefix}'] = pdf_bytes
+        # Gerar PDF (falhas, como o brasão ausente, aparecem junto dos erros de validação).
+        # O livro é gravado em disco e a sessão guarda só o caminho (ver Arquivos gerados).
+        caminho_pdf = novo_arquivo_saida('.pdf')
+        # Opcional: capa, termos e livro em um único PDF, pronto para impressão
+        caminho_encadernado = novo_arquivo_saida('.pdf') if st.session_state.get(f'encadernado_{key_prefix}') else None
+        try:
+            gravar_pdf_matricula(df, dados_escola, key_prefix, caminho_pdf)
+            if caminho_encadernado:
+                gravar_documentos_encadernados(df, dados_escola, key_prefix, caminho_encadernado)
+        except Exception as e:
+            for caminho in (caminho_pdf, caminho_encadernado):
+                if caminho:
+                    remover_arquivo_saida(caminho)
+            st.session_state[f'erros_{key_prefix}'] = [f"Erro ao gerar o PDF: {e}"]
+            st.session_state[f'sucesso_{key_prefix}'] = False
+            return
+        st.session_state[f'erros_{key_prefix}'] = []
+        st.session_state[f'sucesso_{key_prefix}'] = True
+        guardar_arquivo_sessao(f'pdf_arquivo_{key_prefix}', caminho_pdf)
+        guardar_arquivo_sessao(f'pdf_encadernado_{key_prefix}', caminho_encadernado)
         st.session_state[f'pdf_name_{key_prefix}'] = filename_pdf
 
 
@@ -426,6 +315,20 @@ def renderizar_ui_processamento(df, titulo_sucesso, dados_escola):
     #st.dataframe(df.head(10))
     #st.write("---")
     
+    mostrar_avisos(df)
+
+    # Tempo e linhas processadas por etapa do tratamento
+    metricas = df.attrs.get('metricas_tratamento')
+    if metricas:
+        with st.expander("Etapas do tratamento"):
+            st.dataframe(pd.DataFrame(metricas), hide_index=True)
+
+    if "EJA 2º SEM" not in key_prefix:
+        st.checkbox(
+            "Gerar também o livro encadernado (capa, termos e livro em um único PDF)",
+            key=f"encadernado_{key_prefix}"
+        )
+
     # Botão de Ação (Callback)
     st.button(
         f"Criar Documentos",
@@ -443,11 +346,11 @@ def renderizar_ui_processamento(df, titulo_sucesso, dados_escola):
         st.success(f"Arquivos gerados com sucesso!")
         
         # Área de Download Persistente (empilhada verticalmente)
-        if f'pdf_bytes_{key_prefix}' in st.session_state:
+        if st.session_state.get(f'pdf_arquivo_{key_prefix}'):
             # Botão PDF
             st.download_button(
                 label=f"Baixar {titulo_sucesso} em PDF",
-                data=st.session_state[f'pdf_bytes_{key_prefix}'],
+                data=leitor_arquivo_saida(st.session_state[f'pdf_arquivo_{key_prefix}']),
                 file_name=st.session_state[f'pdf_name_{key_prefix}'],
                 mime="application/pdf",
                 key=f"dl_pdf_{key_prefix}"
@@ -455,7 +358,7 @@ def renderizar_ui_processamento(df, titulo_sucesso, dados_escola):
             if "EJA 2º SEM" not in key_prefix:
                 st.write("\n")  # Espaçamento
                 # Termo de Abertura
-                termo_bytes = gerar_termo_abertura(dados_escola)
+                termo_bytes = documento_escola('abertura', dados_escola)
                 st.download_button(
                     label="Baixar Termo de Abertura",
                     data=termo_bytes,
@@ -465,7 +368,7 @@ def renderizar_ui_processamento(df, titulo_sucesso, dados_escola):
                 )
                 st.write("\n")
                 # Termo de Encerramento
-                termo_enc_bytes = gerar_termo_encerramento(dados_escola)
+                termo_enc_bytes = documento_escola('encerramento', dados_escola)
                 st.download_button(
                     label="Baixar Termo de Encerramento",
                     data=termo_enc_bytes,
@@ -475,7 +378,7 @@ def renderizar_ui_processamento(df, titulo_sucesso, dados_escola):
                 )
                 st.write("\n")
                 # Capa
-                capa_bytes = gerar_capa(dados_escola)
+                capa_bytes = documento_escola('capa', dados_escola)
                 st.download_button(
                     label="Baixar Capa do Livro de Matrículas",
                     data=capa_bytes,
@@ -483,6 +386,166 @@ def renderizar_ui_processamento(df, titulo_sucesso, dados_escola):
                     mime="application/pdf",
                     key=f"dl_capa_{key_prefix}"
                 )
+                if st.session_state.get(f'pdf_encadernado_{key_prefix}'):
+                    st.write("\n")
+                    # Livro encadernado (capa, termos e livro)
+                    st.download_button(
+                        label="Baixar Livro Encadernado (capa, termos e livro)",
+                        data=leitor_arquivo_saida(st.session_state[f'pdf_encadernado_{key_prefix}']),
+                        file_name=f"livro_matricula{dados_escola.get('ano_letivo', '')}_encadernado.pdf",
+                        mime="application/pdf",
+                        key=f"dl_encadernado_{key_prefix}"
+                    )
+
+# Arquivos gerados
+# O livro e o ZIP do lote ficam em disco: a sessão guarda só o caminho e o download lê o arquivo
+# apenas quando o botão é clicado. Arquivos de sessões encerradas são removidos depois
+# de IDADE_MAX_SAIDA, na próxima geração.
+PASTA_SAIDA = os.path.join(tempfile.gettempdir(), 'livro_matriculas')
+IDADE_MAX_SAIDA = 24 * 60 * 60  # 1 dia
+
+def remover_arquivo_saida(caminho):
+    try:
+        os.remove(caminho)
+    except OSError as e:
+        logger.warning("Erro ao remover %s: %s", caminho, e)
+
+def novo_arquivo_saida(sufixo):
+    """Caminho de um arquivo novo (vazio) em PASTA_SAIDA, removendo antes os antigos."""
+    os.makedirs(PASTA_SAIDA, exist_ok=True)
+    limite = time.time() - IDADE_MAX_SAIDA
+    for nome in os.listdir(PASTA_SAIDA):
+        caminho = os.path.join(PASTA_SAIDA, nome)
+        if os.path.getmtime(caminho) < limite:
+            remover_arquivo_saida(caminho)
+    fd, caminho = tempfile.mkstemp(suffix=sufixo, dir=PASTA_SAIDA)
+    os.close(fd)
+    return caminho
+
+def guardar_arquivo_sessao(chave, caminho):
+    """Guarda o caminho na sessão, removendo o arquivo que ele substitui."""
+    anterior = st.session_state.get(chave)
+    if anterior and anterior != caminho and os.path.exists(anterior):
+        remover_arquivo_saida(anterior)
+    st.session_state[chave] = caminho
+
+def leitor_arquivo_saida(caminho):
+    """Função para o data do st.download_button: o arquivo só é lido no clique."""
+    def ler():
+        with open(caminho, 'rb') as f:
+            return f.read()
+    return ler
+
+# Processamento em Lote (ZIP com várias unidades)
+def converter_data_manifesto(valor):
+    """Converte 'DD/MM/AAAA' do manifesto em date (None se vazio)."""
+    if not valor: return None
+    return datetime.strptime(valor, '%d/%m/%Y').date()
+
+def converter_int_manifesto(valor):
+    if not valor: return None
+    return int(float(valor))
+
+def montar_dados_escola_lote(linha, ano_letivo_ref, data_censo_ref):
+    """Monta o dicionário dados_escola a partir de uma linha do manifesto do lote."""
+    dias_eja1 = converter_int_manifesto(linha.get('dias_eja1', ''))
+    dias_eja2 = converter_int_manifesto(linha.get('dias_eja2', ''))
+    data_enc_eja1 = converter_data_manifesto(linha.get('data_enc_eja1', ''))
+    data_enc_eja2 = converter_data_manifesto(linha.get('data_enc_eja2', ''))
+    return {
+        "nome": linha.get('nome', ''),
+        "inep": linha.get('inep', ''),
+        "ano_letivo": ano_letivo_ref,
+        "logradouro": linha.get('logradouro', ''),
+        "numero": linha.get('numero', ''),
+        "bairro": linha.get('bairro', ''),
+        "cep": formatar_cep(linha.get('cep', '')),
+        "telefone": linha.get('telefone', ''),
+        "email": linha.get('email', ''),
+        "data_censo": data_censo_ref,
+        "data_encerramento": converter_data_manifesto(linha.get('data_encerramento', '')),
+        "total_dias_letivos": converter_int_manifesto(linha.get('total_dias_letivos', '')),
+        "data_enc_eja1": data_enc_eja1,
+        "dias_eja1": dias_eja1,
+        "data_enc_eja2": data_enc_eja2,
+        "dias_eja2": dias_eja2,
+        # Qualquer informação do semestre indica oferta; a que faltar é apontada por validar_dados
+        "ofertou_eja_1": dias_eja1 is not None or data_enc_eja1 is not None,
+        "ofertou_eja_2": dias_eja2 is not None or data_enc_eja2 is not None
+    }
+
+def processar_lote(conteudo_zip, ano_letivo_ref, data_censo_ref, destino, encadernado=False):
+    """
+    Gera os documentos de todas as escolas do ZIP no arquivo ZIP `destino` e devolve o relatório.
+    Com encadernado=True, capa, termos e livro (regular) de cada escola vão em um único PDF.
+    Cada livro é gravado página a página em um arquivo temporário e copiado para o ZIP, então
+    nenhum livro inteiro fica em memória.
+    DEPARA e municípios ficam em cache no processo, então são carregados uma única vez para o lote.
+    """
+    relatorio = []
+    livros_gerados = set()
+    with tempfile.TemporaryDirectory() as pasta_temporaria, \
+            zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as zf_saida:
+        caminho_livro = os.path.join(pasta_temporaria, 'livro.pdf')
+        for linha, nome_arquivo, conteudo in iterar_lote_zip(conteudo_zip):
+            escola = f"{linha.get('inep', '')} - {linha.get('nome', '')}"
+            # Pasta por unidade (INEP + nome); um mesmo livro duas vezes só vem de linha repetida no manifesto
+            is_eja2 = linha.get('tipo', '').upper().replace(' ', '') in ('EJA2', 'EJA2ºSEM')
+            pasta = escola.replace('/', '-')
+            nome_livro = f"{pasta}/livro_matricula{ano_letivo_ref}{'2SEM' if is_eja2 else ''}.pdf"
+            if nome_livro in livros_gerados:
+                relatorio.append((escola, "Unidade repetida no manifesto: documentos já gerados para esta linha"))
+                continue
+            if conteudo is None:
+                relatorio.append((escola, f"Arquivo '{nome_arquivo}' não encontrado no ZIP ou formato inválido"))
+                continue
+            try:
+                dados = montar_dados_escola_lote(linha, ano_letivo_ref, data_censo_ref)
+                # Linhas com tipo 'EJA 2' geram o livro do 2º semestre
+                if is_eja2:
+                    dados['ofertou_eja_2'] = True
+                erros = validar_dados(dados)
+                if erros:
+                    relatorio.append((escola, "; ".join(erros)))
+                    continue
+
+                df = carregar_arquivo(
+                    conteudo, nome_arquivo,
+                    lambda d: tratar_dados(d, ano_letivo_ref, data_censo_ref, colunas_necessarias(ano_letivo_ref))
+                )
+                if is_eja2:
+                    gravar_pdf_matricula(df, dados, "Livro EJA 2º SEM", caminho_livro)
+                    zf_saida.write(caminho_livro, nome_livro)
+                elif encadernado:
+                    gravar_documentos_encadernados(df, dados, "Livro de Matrículas", caminho_livro)
+                    zf_saida.write(caminho_livro, f"{pasta}/livro_matricula{ano_letivo_ref}_encadernado.pdf")
+                else:
+                    gravar_pdf_matricula(df, dados, "Livro de Matrículas", caminho_livro)
+                    zf_saida.write(caminho_livro, nome_livro)
+                    # Capa e termos têm poucas páginas: vão direto da memória
+                    zf_saida.writestr(f"{pasta}/Termo de Abertura {ano_letivo_ref}.pdf", gerar_termo_abertura(dados))
+                    zf_saida.writestr(f"{pasta}/Termo de Encerramento {ano_letivo_ref}.pdf", gerar_termo_encerramento(dados))
+                    zf_saida.writestr(f"{pasta}/capa_livro_{ano_letivo_ref}.pdf", gerar_capa(dados))
+                livros_gerados.add(nome_livro)
+                avisos = textos_avisos(df)
+                relatorio.append((escola, f"OK (avisos: {'; '.join(avisos)})" if avisos else "OK"))
+            except Exception as e:
+                relatorio.append((escola, f"Erro: {e}"))
+    return relatorio
+
+def processar_lote_action(uploaded_zip, ano_letivo_ref, data_censo_ref, encadernado):
+    """Função chamada pelo callback do botão de processar o lote"""
+    caminho_zip = novo_arquivo_saida('.zip')
+    try:
+        relatorio = processar_lote(uploaded_zip.getvalue(), ano_letivo_ref, data_censo_ref, caminho_zip, encadernado)
+        guardar_arquivo_sessao('lote_zip', caminho_zip)
+        st.session_state['lote_relatorio'] = relatorio
+        st.session_state['lote_erro'] = None
+    except Exception as e:
+        remover_arquivo_saida(caminho_zip)
+        guardar_arquivo_sessao('lote_zip', None)
+        st.session_state['lote_relatorio'] = []
+        st.session_state['lote_erro'] = str(e)
 
 col_imp1, col_imp2 = st.columns(2)
 
@@ -520,12 +583,7 @@ with col_imp1:
     
     if uploaded_file1 is not None:
         try:
-            if uploaded_file1.name.endswith('.csv'):
-                df1 = pd.read_csv(uploaded_file1)
-            else:
-                df1 = pd.read_excel(uploaded_file1)
-            
-            df1 = tratar_dados(df1, ano_letivo, dados_escola['data_censo'])
+            df1 = carregar_upload(uploaded_file1, ano_letivo, dados_escola['data_censo'])
             renderizar_ui_processamento(df1, "Livro de Matrículas", dados_escola)
             
         except Exception as e:
@@ -540,14 +598,52 @@ with col_imp2:
     
     if uploaded_file2 is not None:
         try:
-            if uploaded_file2.name.endswith('.csv'):
-                df2 = pd.read_csv(uploaded_file2)
-            else:
-                df2 = pd.read_excel(uploaded_file2)
-            
-            df2 = tratar_dados(df2, ano_letivo, dados_escola['data_censo'])
+            df2 = carregar_upload(uploaded_file2, ano_letivo, dados_escola['data_censo'])
             renderizar_ui_processamento(df2, "Livro EJA 2º SEM", dados_escola)
             
         except Exception as e:
             st.error(f"Erro ao processar arquivo 2: {e}")
     
+
+st.write("---")
+
+# LOTE: Várias unidades escolares em um único ZIP
+st.markdown("### Processamento em Lote")
+st.info(
+    "Envie um arquivo ZIP com as exportações do SUAP de cada unidade e o manifesto 'escolas.csv' "
+    "(colunas: arquivo, nome, inep, logradouro, numero, bairro, cep, telefone, email, "
+    "total_dias_letivos, data_encerramento e, se houver, dias_eja1, data_enc_eja1, dias_eja2, data_enc_eja2, tipo). "
+    "Ano letivo e data do censo são os informados acima."
+)
+
+uploaded_zip = st.file_uploader("Upload Lote (ZIP)", type=["zip"], key="up_lote")
+
+if uploaded_zip is not None:
+    encadernado_lote = st.checkbox(
+        "Livro encadernado: capa, termos e livro de cada unidade em um único PDF",
+        key="lote_encadernado"
+    )
+    st.button(
+        "Processar Lote",
+        key="btn_lote",
+        on_click=processar_lote_action,
+        args=(uploaded_zip, ano_letivo, dados_escola['data_censo'], encadernado_lote)
+    )
+
+    if st.session_state.get('lote_erro'):
+        st.error(f"Erro ao processar lote: {st.session_state['lote_erro']}")
+
+    if st.session_state.get('lote_relatorio'):
+        st.dataframe(
+            pd.DataFrame(st.session_state['lote_relatorio'], columns=["Unidade", "Situação"]),
+            hide_index=True
+        )
+
+    if st.session_state.get('lote_zip'):
+        st.download_button(
+            label="Baixar Documentos do Lote (ZIP)",
+            data=leitor_arquivo_saida(st.session_state['lote_zip']),
+            file_name=f"livros_matricula_{ano_letivo}.zip",
+            mime="application/zip",
+            key="dl_lote"
+        )
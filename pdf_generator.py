@@ -1,8 +1,18 @@
+# fpdf fixado em 1.7.2 (pyproject.toml): BufferSaida, obter_imagem, os modelos (usar_modelo) e a gravação contínua usam partes internas dessa versão
 from fpdf import FPDF
+from fpdf.php import UTF8ToUTF16BE
 from datetime import datetime
 import pandas as pd
+import numpy as np
+import copy
+import logging
 import math
+import os
+import threading
 import unicodedata
+import zlib
+
+logger = logging.getLogger(__name__)
 
 def fix_text(text):
     if text is None: return ""
@@ -12,17 +22,292 @@ def fix_text(text):
     s = s.replace("‘", "'").replace("’", "'")
     return s.encode('latin-1', 'replace').decode('latin-1')
 
+# Colunas de data do relatório (datetime no DataFrame tratado) e o texto exibido quando vazias
+COLUNAS_DATA_RELATORIO = {
+    'Data de Nascimento': '',
+    'Data da situação': '-'
+}
+
+def formatar_datas_relatorio(df):
+    """Formata as colunas de data como DD/MM/AAAA (feito apenas na renderização)."""
+    formatadas = {}
+    for col, vazio in COLUNAS_DATA_RELATORIO.items():
+        if col in df.columns and pd.api.types.is_datetime64_any_dtype(df[col]):
+            formatadas[col] = df[col].dt.strftime('%d/%m/%Y').fillna(vazio)
+    return df.assign(**formatadas) if formatadas else df
+
+# Brasão
+# Decodificado uma única vez por processo e entregue já pronto (dados da imagem processados
+# pelo fpdf) a todos os documentos, inclusive a todas as escolas de um lote.
+ARQUIVO_BRASAO = 'brasao.png'
+
+_imagens = {}
+_trava_imagens = threading.Lock()
+
+def obter_imagem(caminho=ARQUIVO_BRASAO):
+    """
+    (dados da imagem, versão do PDF exigida) decodificados pelo fpdf (cache do processo).
+    Erro explícito se o arquivo não existir.
+    """
+    with _trava_imagens:
+        imagem = _imagens.get(caminho)
+        if imagem is None:
+            if not os.path.isfile(caminho):
+                raise FileNotFoundError(f"Imagem do brasão não encontrada: '{caminho}'")
+            leitor = FPDF()
+            info = leitor._parsejpg(caminho) if caminho.lower().endswith(('.jpg', '.jpeg')) else leitor._parsepng(caminho)
+            # O _parsepng sobe o documento para PDF 1.4 quando o PNG tem canal alfa (SMask);
+            # a versão fica guardada para ser aplicada a cada documento que usar a imagem
+            imagem = (info, leitor.pdf_version)
+            _imagens[caminho] = imagem
+    return imagem
+
+def inserir_imagem(pdf, x, y, w, h, caminho=ARQUIVO_BRASAO):
+    """pdf.image com a imagem do cache, sem reler nem decodificar o arquivo."""
+    if caminho not in pdf.images:
+        info, versao = obter_imagem(caminho)
+        # O fpdf altera o dicionário da imagem ao gravar o PDF ('n', remove 'data' e 'smask'):
+        # cada documento recebe a sua cópia e o cache não é alterado
+        pdf.images[caminho] = dict(copy.deepcopy(info), i=len(pdf.images) + 1)
+        if versao > pdf.pdf_version:
+            pdf.pdf_version = versao
+    pdf.image(caminho, x, y, w, h)
+
+class BufferSaida:
+    """
+    Buffer do documento no fechamento. O fpdf 1.7.2 acumula o PDF com `self.buffer += linha`
+    em uma str, o que copia o buffer inteiro a cada linha (tempo quadrático no número de
+    páginas). Aqui as linhas vão para uma lista; só len() e += são usados até o fechamento.
+    """
+    def __init__(self):
+        self.partes = []
+        self.tamanho = 0
+
+    def __iadd__(self, texto):
+        self.partes.append(texto)
+        self.tamanho += len(texto)
+        return self
+
+    def __len__(self):
+        return self.tamanho
+
+    def __str__(self):
+        return ''.join(self.partes)
+
 class PDF(FPDF):
-    def __init__(self, titulo_doc, dados_escola):
+    # Y onde a tabela começa (fim do cabeçalho: y_row3 + h_row3 + 4) e margem inferior do conteúdo
+    Y_INICIO_TABELA = 53
+    MARGEM_INFERIOR = 10
+
+    def __init__(self, titulo_doc, dados_escola, arquivo=None):
         super().__init__(orientation='L', unit='mm', format='A4')
+        # Gravação contínua (ver _endpage): arquivo binário aberto que recebe as páginas prontas
+        self.arquivo = arquivo
+        self.gravados = 0 # Bytes já gravados no arquivo (base dos offsets do xref)
+        self.versao_gravada = None # Versão escrita no cabeçalho do arquivo (na primeira página gravada)
+        self.paginas_pendentes = [] # Páginas com o alias do total de páginas, gravadas só no fechamento
         self.titulo_doc = titulo_doc
         self.dados_escola = dados_escola
         # Margens: Left, Top, Right
         self.set_margins(10, 30, 10)  # margem superior 3cm
-        self.set_auto_page_break(auto=True, margin=10)
+        # Quebras de página decididas pelo layout da tabela (paginar), nunca no meio de uma linha
+        self.set_auto_page_break(auto=False, margin=self.MARGEM_INFERIOR)
         self.current_header_info = {} # Dicionário para informações dinâmicas do cabeçalho por grupo
+        self.modelos = {} # Conteúdo fixo de cabeçalho/rodapé (ver usar_modelo)
+        self.altura_livro = self.h # Altura das páginas do livro (paisagem), mesmo depois de páginas avulsas retrato
+        self.paginas_avulsas = set() # Páginas sem cabeçalho/rodapé do livro (capa e termos encadernados)
+        self.avulsa_pendente = False
+        self.buffer = BufferSaida()
 
-    def header(self):
+    def close(self):
+        super().close()
+        # output() grava/devolve o buffer como str, como no fpdf
+        if isinstance(self.buffer, BufferSaida):
+            self.buffer = str(self.buffer)
+
+    # Modelos (Form XObjects)
+    # O conteúdo fixo de cabeçalho e rodapé é desenhado na primeira página, guardado como
+    # modelo e, em todas as páginas, só referenciado com "/Tpl<nome> Do". O fpdf 1.7.2 não
+    # tem suporte a modelos, então os objetos são escritos junto com as imagens.
+    def usar_modelo(self, nome, desenhar):
+        """Referencia o modelo `nome` na página atual, criando-o com `desenhar` no primeiro uso."""
+        if nome not in self.modelos:
+            marca = len(self.pages[self.page])
+            desenhar()
+            self.modelos[nome] = {
+                'conteudo': self.pages[self.page][marca:],
+                'bbox': (self.w_pt, self.h_pt), # página do livro (paisagem), mesmo no PDF encadernado
+                'n': None
+            }
+            self.pages[self.page] = self.pages[self.page][:marca]
+        # Cores em preto (o modelo herda o estado da página, que pode estar com fundo cinza)
+        self._out(f'q 0 G 0 g /Tpl{nome} Do Q')
+        # O Do restaura o estado gráfico ao final: a próxima set_font precisa ser reenviada
+        self.font_family = ''
+
+    def _putimages(self):
+        super()._putimages()
+        filtro = '/Filter /FlateDecode ' if self.compress else ''
+        for modelo in self.modelos.values():
+            conteudo = modelo['conteudo'].encode('latin-1')
+            if self.compress:
+                conteudo = zlib.compress(conteudo)
+            self._newobj()
+            modelo['n'] = self.n
+            self._out('<</Type /XObject /Subtype /Form /Resources 2 0 R')
+            self._out('/BBox [0 0 %.2f %.2f]' % modelo['bbox'])
+            self._out(filtro + '/Length ' + str(len(conteudo)) + '>>')
+            self._putstream(conteudo)
+            self._out('endobj')
+
+    def _putxobjectdict(self):
+        super()._putxobjectdict()
+        for nome, modelo in self.modelos.items():
+            self._out(f'/Tpl{nome} {modelo["n"]} 0 R')
+
+    # Gravação contínua
+    # Com um arquivo, o conteúdo de cada página é gravado assim que ela termina (depois do
+    # rodapé) e sai da memória. No fechamento são gravados os objetos que dependem do documento
+    # inteiro: os dicionários das páginas (links internos e /Group, que depende da versão final),
+    # a raiz das páginas, os recursos (fontes, imagens, modelos), info, catálogo e xref. A
+    # numeração dos objetos é a do fpdf (página n: 1+2n, conteúdo: 2+2n). Páginas que usam o
+    # alias do total de páginas (alias_nb_pages) esperam o fechamento, quando o total é conhecido.
+    # Sem arquivo, o fpdf monta tudo em memória, como antes.
+    def _newobj(self):
+        self.n += 1
+        self.offsets[self.n] = self.gravados + len(self.buffer)
+        self._out(str(self.n) + ' 0 obj')
+
+    def _descarregar(self):
+        """Passa o que está no buffer para o arquivo."""
+        self.arquivo.write(str(self.buffer).encode('latin-1'))
+        self.gravados += len(self.buffer)
+        self.buffer = BufferSaida()
+
+    def _endpage(self):
+        super()._endpage()
+        if self.arquivo is None:
+            return
+        if self.versao_gravada is None:
+            self.versao_gravada = self.pdf_version
+            self._putheader()
+        if self._usa_alias(self.page):
+            self.paginas_pendentes.append(self.page)
+            return
+        self._putconteudo(self.page)
+        self.pages[self.page] = ''
+        self._descarregar()
+
+    def _usa_alias(self, n):
+        alias = getattr(self, 'str_alias_nb_pages', None)
+        return bool(alias) and (alias in self.pages[n] or UTF8ToUTF16BE(alias, False) in self.pages[n])
+
+    def _putconteudo(self, n):
+        """Objeto do conteúdo da página n (2+2n)."""
+        conteudo = self.pages[n].encode('latin-1')
+        filtro = ''
+        if self.compress:
+            conteudo = zlib.compress(conteudo)
+            filtro = '/Filter /FlateDecode '
+        self.offsets[2 + 2 * n] = self.gravados + len(self.buffer)
+        self._out(str(2 + 2 * n) + ' 0 obj')
+        self._out('<<' + filtro + '/Length ' + str(len(conteudo)) + '>>')
+        self._putstream(conteudo)
+        self._out('endobj')
+
+    def _putdicionario_pagina(self, n, w_pt, h_pt):
+        """Objeto da página n (1+2n), como no _putpages do fpdf."""
+        self.offsets[1 + 2 * n] = self.gravados + len(self.buffer)
+        self._out(str(1 + 2 * n) + ' 0 obj')
+        self._out('<</Type /Page')
+        self._out('/Parent 1 0 R')
+        if n in self.orientation_changes:
+            self._out('/MediaBox [0 0 %.2f %.2f]' % (h_pt, w_pt))
+        self._out('/Resources 2 0 R')
+        if self.page_links and n in self.page_links:
+            anotacoes = '/Annots ['
+            for pl in self.page_links[n]:
+                rect = '%.2f %.2f %.2f %.2f' % (pl[0], pl[1], pl[0] + pl[2], pl[1] - pl[3])
+                anotacoes += '<</Type /Annot /Subtype /Link /Rect [' + rect + '] /Border [0 0 0] '
+                if isinstance(pl[4], str):
+                    anotacoes += '/A <</S /URI /URI ' + self._textstring(pl[4]) + '>>>>'
+                else:
+                    destino = self.links[pl[4]]
+                    h = w_pt if destino[0] in self.orientation_changes else h_pt
+                    anotacoes += '/Dest [%d 0 R /XYZ 0 %.2f null]>>' % (1 + 2 * destino[0], h - destino[1] * self.k)
+            self._out(anotacoes + ']')
+        if self.pdf_version > '1.3':
+            self._out('/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>')
+        self._out('/Contents ' + str(2 + 2 * n) + ' 0 R>>')
+        self._out('endobj')
+
+    def _enddoc(self):
+        if self.arquivo is None:
+            return super()._enddoc()
+        nb = self.page
+        if self.def_orientation == 'P':
+            w_pt, h_pt = self.fw_pt, self.fh_pt
+        else:
+            w_pt, h_pt = self.fh_pt, self.fw_pt
+        # Páginas com o alias: o total agora é conhecido
+        for n in self.paginas_pendentes:
+            alias = self.str_alias_nb_pages
+            self.pages[n] = self.pages[n].replace(UTF8ToUTF16BE(alias, False), UTF8ToUTF16BE(str(nb), False))
+            self.pages[n] = self.pages[n].replace(alias, str(nb))
+            self._putconteudo(n)
+            self.pages[n] = ''
+        for n in range(1, nb + 1):
+            self._putdicionario_pagina(n, w_pt, h_pt)
+        self.n = 2 + 2 * nb
+        # Raiz das páginas (objeto 1)
+        self.offsets[1] = self.gravados + len(self.buffer)
+        self._out('1 0 obj')
+        self._out('<</Type /Pages')
+        self._out('/Kids [' + ''.join(str(3 + 2 * i) + ' 0 R ' for i in range(nb)) + ']')
+        self._out('/Count ' + str(nb))
+        self._out('/MediaBox [0 0 %.2f %.2f]' % (w_pt, h_pt))
+        self._out('>>')
+        self._out('endobj')
+        self._putresources()
+        # O fpdf grava o offset do dicionário de recursos (objeto 2) relativo ao buffer
+        self.offsets[2] += self.gravados
+        # Info
+        self._newobj()
+        self._out('<<')
+        self._putinfo()
+        self._out('>>')
+        self._out('endobj')
+        # Catálogo
+        self._newobj()
+        self._out('<<')
+        self._putcatalog()
+        self._out('>>')
+        self._out('endobj')
+        # Xref e trailer
+        inicio_xref = self.gravados + len(self.buffer)
+        self._out('xref')
+        self._out('0 ' + str(self.n + 1))
+        self._out('0000000000 65535 f ')
+        for i in range(1, self.n + 1):
+            self._out('%010d 00000 n ' % self.offsets[i])
+        self._out('trailer')
+        self._out('<<')
+        self._puttrailer()
+        self._out('>>')
+        self._out('startxref')
+        self._out(inicio_xref)
+        self._out('%%EOF')
+        self.state = 3
+        self._descarregar()
+        # Uma imagem com transparência em página posterior à primeira sobe a versão (1.3 -> 1.4):
+        # o cabeçalho, de mesmo tamanho, é reescrito
+        if self.pdf_version != self.versao_gravada:
+            self.arquivo.seek(0)
+            self.arquivo.write(('%PDF-' + self.pdf_version).encode('latin-1'))
+            self.arquivo.seek(0, os.SEEK_END)
+
+    def cabecalho_fixo(self):
+        """Parte do cabeçalho igual em todas as páginas: brasão, linhas institucionais e dados da escola."""
         # Configurar larguras e posições
         margin_left = 5
         page_width = 297  # A4 Landscape
@@ -31,7 +316,6 @@ class PDF(FPDF):
         # Dados Escola
         nome = fix_text(self.dados_escola.get('nome', ''))
         inep = fix_text(self.dados_escola.get('inep', ''))
-        ano = fix_text(self.dados_escola.get('ano_letivo', ''))
         end = fix_text(self.dados_escola.get('logradouro', ''))
         num = fix_text(self.dados_escola.get('numero', ''))
         bairro = fix_text(self.dados_escola.get('bairro', ''))
@@ -61,11 +345,8 @@ class PDF(FPDF):
         # Centralizado horizontalmente, alinhado ao topo
         # logo_padding = (h_row1 - logo_height) / 2 # REMOVIDO para alinhar ao topo
         
-        try:
-             # Alinhando ao topo com padding top = 2mm (igual Col 2)
-             self.image('brasao.png', x_start + (w_col1 - logo_width)/2, y_start + 2, logo_width, logo_height)
-        except:
-             pass
+        # Alinhando ao topo com padding top = 2mm (igual Col 2)
+        inserir_imagem(self, x_start + (w_col1 - logo_width)/2, y_start + 2, logo_width, logo_height)
 
         # Coluna 2: Informações Institucionais
         self.set_xy(x_start + w_col1, y_start)
@@ -119,6 +400,41 @@ class PDF(FPDF):
             self.cell(w_col3, line_h3, txt, 0, 0, 'R')
             cur_y3 += line_h3
 
+    def pagina_avulsa(self, desenhar):
+        """
+        Página retrato sem o cabeçalho e o rodapé do livro, desenhada por `desenhar(pdf, dados_escola)`
+        (capa e termos no PDF encadernado). Margens e espessura de linha do livro são restauradas depois.
+        """
+        margens = (self.l_margin, self.t_margin, self.r_margin)
+        espessura = self.line_width
+        self.avulsa_pendente = True
+        self.add_page('P')
+        # Cores de um documento novo (o livro deixa o preenchimento em cinza)
+        self.set_draw_color(0)
+        self.set_fill_color(0)
+        self.set_text_color(0)
+        desenhar(self, self.dados_escola)
+        self.set_margins(*margens)
+        self.set_line_width(espessura)
+
+    def header(self):
+        if self.avulsa_pendente:
+            self.paginas_avulsas.add(self.page)
+            self.avulsa_pendente = False
+            return
+
+        # Parte fixa desenhada uma única vez por documento (modelo reaproveitado em cada página)
+        self.usar_modelo('Cabecalho', self.cabecalho_fixo)
+
+        # Configurar larguras e posições (as mesmas da parte fixa)
+        margin_left = 5
+        page_width = 297  # A4 Landscape
+        usable_width = page_width - 2 * margin_left
+        ano = fix_text(self.dados_escola.get('ano_letivo', ''))
+        x_start = margin_left
+        y_start = 20
+        h_row1 = 20
+
         # --- Linha 2: Título (centralizado) ---
         h_row2 = 5
         y_row2 = y_start + h_row1 - 1
@@ -203,9 +519,16 @@ class PDF(FPDF):
         
         # Espaço final entre cabeçalho e tabela
         # Ajustando posição Y final para garantir espaçamento antes da tabela
-        self.set_y(y_row3 + h_row3 + 4)
+        self.set_y(self.Y_INICIO_TABELA)
 
     def footer(self):
+        if self.page in self.paginas_avulsas:
+            return
+        # Rodapé (assinaturas) é igual em todas as páginas: modelo desenhado uma única vez
+        self.usar_modelo('Rodape', self.rodape_fixo)
+
+    def rodape_fixo(self):
+        """Linhas de assinatura da Direção e do Pedagogo Supervisor."""
         # Posição do rodapé (Mantendo original)
         self.set_y(-8)
         
@@ -244,38 +567,17 @@ class PDF(FPDF):
         self.cell(col_width, 3, 'Pedagogo Supervisor', 0, 0, 'C')
         
 
-def gerar_pdf_matricula(df, dados_escola, titulo_documento):
-    pdf = PDF(titulo_documento, dados_escola)
-    # Configuração de Fonte reduzida para caber muitas colunas
-    pdf.set_font('Arial', 'B', 6)
-
-    # 1. Preparar Dados para o Relatório
-    df_relatorio = df.copy()
-
-    # Ajuste: Se for EJA 2º Semestre, fixar "Pós Censo" como "-"
-    if "EJA 2º SEM" in titulo_documento:
-        df_relatorio['Pós Censo'] = "-"
-    
-    # Criar coluna de Ordem Sequencial com nome "#"
-    # Garante que não duplica se já existir no arquivo original
-    if '#' in df_relatorio.columns:
-        df_relatorio.drop(columns=['#'], inplace=True)
-        
-    # df_relatorio.insert(0, '#', range(1, len(df_relatorio) + 1)) # Moved to inside group loop
-    
-    # Mapeamento de Colunas
-    ano_letivo = dados_escola.get('ano_letivo', '')
-    col_age_dynamic = f"Idade em 31/03/{ano_letivo}"
-    
+def mapa_colunas_relatorio(ano_letivo):
+    """Coluna do DataFrame tratado -> título da coluna no livro de matrículas."""
     # Ajustando para garantir que a chave '#' seja usada consistentemente
-    mapa_colunas = {
+    return {
         '#': '#', 
         'Grupo/Ano/Fase': 'Grupo/Ano/Fase',
         'Matrícula': 'Matrícula',
         'CPF': 'CPF',
         'Nome': 'Nome',
         'Data de Nascimento': 'Data de Nascimento',
-        col_age_dynamic: 'Idade (31/03)',
+        f"Idade em 31/03/{ano_letivo}": 'Idade (31/03)',
         'Sexo': 'Sexo',
         'Nome da Mãe': 'Filiação 1',
         'Nome do Pai': 'Filiação 2',
@@ -287,25 +589,263 @@ def gerar_pdf_matricula(df, dados_escola, titulo_documento):
         'Situação no Ano Selecionado': 'Situação',
         'Data do Último Procedimento': 'Data da situação'
     }
-    # OBS: O código anterior do usuario (step 293) mudou 'Data de Matrícula' para 'Data Matrícula Suap na Unidade' no mapa_colunas??
-    # Não, o diff mostrava 'Data de Matrícula': 'Data Matrícula Suap' e user alterou para 'Data Matrícula Suap'.
-    # Vou usar KEYS que correspondem ao DF tratado em APP.PY ('Data de Matrícula').
+
+# Colunas usadas no agrupamento, no cabeçalho e na ordenação (além das exibidas)
+COLUNAS_AUXILIARES_RELATORIO = [
+    'Turma no Ano Selecionado', 'Matriz', 'Curso', 'Descrição do Curso', 'Data de Matrícula', 'Ordenador'
+]
+
+def colunas_necessarias(ano_letivo):
+    """Colunas do DataFrame tratado lidas por gerar_pdf_matricula."""
+    return list(mapa_colunas_relatorio(ano_letivo)) + COLUNAS_AUXILIARES_RELATORIO
+
+# Layout da tabela do livro
+# As alturas das linhas de uma turma são calculadas antes do desenho, coluna a coluna
+# (cada valor distinto de uma coluna é medido uma vez). Com as alturas prontas, as linhas
+# são distribuídas nas páginas pela altura real e o desenho não decide mais quebras.
+ALTURA_LINHA_TEXTO = 4
+ALTURA_LINHA_CABECALHO = 3
+ALTURA_MIN_LINHA = 8  # 2 linhas de texto
+
+# Colunas com alinhamento central
+COLUNAS_CENTRALIZADAS = [
+    '#',
+    'Grupo/Ano/Fase', 
+    'Matrícula', 
+    'CPF', 
+    'Data de Nascimento', 
+    'Idade (31/03)', 
+    'Sexo', 
+    'Data Matrícula Suap', 
+    'PNE', 
+    'Pós Censo', 
+    'Data da situação'
+]
+
+# Colunas alinhadas ao topo da célula (as demais ficam centralizadas na vertical)
+COLUNAS_ALINHADAS_TOPO = ['Nome', 'Filiação 1', 'Filiação 2', 'Naturalidade', 'Nacionalidade', 'Situação']
+
+def criar_medidor():
+    """Instância FPDF sem páginas, usada só para medir texto (set_font não gera saída)."""
+    return FPDF(orientation='L', unit='mm', format='A4')
+
+def contar_linhas(medidor, text, effective_w):
+    """Número de linhas que o texto ocupa em multi_cell com a largura útil informada (fonte atual)."""
+    if not text:
+        return 1
+    num_lines = 0
+    space_w = medidor.get_string_width(' ')
+    for line in text.split('\n'):
+        if not line:
+            num_lines += 1
+            continue
+        curr_line_w = 0
+        # Palavra por palavra
+        for word in line.split(' '):
+            word_w = medidor.get_string_width(word)
+            # Se primeira palavra (e cabe na largura ou é maior que largura total)
+            if curr_line_w == 0:
+                if word_w > effective_w:
+                    # Palavra maior que a célula: assumindo wrap conservador
+                    wrap_count = math.ceil(word_w / effective_w)
+                    num_lines += wrap_count if wrap_count > 0 else 1
+                    curr_line_w = 0 
+                else:
+                    curr_line_w = word_w
+            else:
+                if curr_line_w + space_w + word_w > effective_w:
+                    # Quebra linha
+                    num_lines += 1
+                    curr_line_w = word_w
+                else:
+                    curr_line_w += space_w + word_w
+        num_lines += 1
+    return num_lines
+
+def fonte_celula(col_name, text, is_header):
+    """(tamanho da fonte, fonte especial) da célula: textos longos conhecidos usam fonte 5."""
+    if not is_header:
+        if col_name == 'Nacionalidade' and 'Brasileira - Nascido no exterior' in text:
+            return 5, True
+        if col_name in ['Filiação 1', 'Filiação 2'] and 'NÃO CONSTA' in text:
+            return 5, True
+    return 6, False
+
+def medir_coluna(medidor, valores, col_name, w, c_margin, is_header=False):
+    """
+    Células (texto, altura do conteúdo, fonte especial, tamanho da fonte) de uma coluna.
+    Valores repetidos na coluna são medidos uma única vez.
+    """
+    line_height = ALTURA_LINHA_CABECALHO if is_header else ALTURA_LINHA_TEXTO
+    style = 'B' if is_header else ''
+    # Ajuste de largura útil para cálculo de quebra de linha
+    effective_w = w - (2 * c_margin)
+    if effective_w < 0: effective_w = 0.1 # defensive
+
+    medidas = {}
+    celulas = []
+    for raw_val in valores:
+        celula = medidas.get(raw_val)
+        if celula is None:
+            text = fix_text(raw_val)
+            font_size, special_font = fonte_celula(col_name, text, is_header)
+            medidor.set_font('Arial', style, font_size)
+            celula = (text, contar_linhas(medidor, text, effective_w) * line_height, special_font, font_size)
+            medidas[raw_val] = celula
+        celulas.append(celula)
+    return celulas
+
+def textos_coluna(serie):
+    """Valores da coluna já convertidos para texto (nulos NaN/NA viram vazio), em um array."""
+    textos = serie.astype(str).to_numpy(dtype=object)
+    textos[serie.isna().to_numpy()] = ""
+    return textos
+
+def calcular_layout(medidor, valores_colunas, colunas, larguras, c_margin, is_header=False):
+    """
+    Layout de um bloco de linhas, a partir dos textos de cada coluna: devolve as células de
+    cada linha (tuplas) e a altura de cada linha (maior altura de conteúdo, com mínimo de
+    2 linhas nos dados).
+    """
+    if not len(valores_colunas) or not len(valores_colunas[0]):
+        return [], np.array([])
+    min_h = ALTURA_LINHA_CABECALHO if is_header else ALTURA_MIN_LINHA
+    por_coluna = [
+        medir_coluna(medidor, valores_colunas[j], col, larguras[j], c_margin, is_header)
+        for j, col in enumerate(colunas)
+    ]
+    alturas_conteudo = np.array([[celula[1] for celula in coluna] for coluna in por_coluna])
+    alturas = np.maximum(alturas_conteudo.max(axis=0), min_h)
+    return list(zip(*por_coluna)), alturas
+
+def paginar(alturas, altura_cabecalho, altura_disponivel):
+    """Intervalos [inicio, fim) de linhas por página, enchendo cada página pela altura real das linhas."""
+    paginas = []
+    inicio = 0
+    usado = altura_cabecalho
+    for i, h in enumerate(alturas):
+        # Uma linha mais alta que a página inteira ocupa uma página sozinha
+        if i > inicio and usado + h > altura_disponivel:
+            paginas.append((inicio, i))
+            inicio = i
+            usado = altura_cabecalho
+        usado += h
+    if len(alturas) > inicio:
+        paginas.append((inicio, len(alturas)))
+    return paginas
+
+def desenhar_linha(pdf, celulas, colunas, larguras, max_h, is_header=False):
+    """Desenha uma linha da tabela com o layout já calculado."""
+    line_height = ALTURA_LINHA_CABECALHO if is_header else ALTURA_LINHA_TEXTO
+    start_y = pdf.get_y()
+    current_x = pdf.get_x()
+    
+    for i, (text, content_h, special_font, font_size) in enumerate(celulas):
+        w = larguras[i]
+        col_name = colunas[i]
+        
+        # Desenhar Borda/Fundo
+        if is_header:
+            pdf.set_fill_color(220, 220, 220)
+            pdf.rect(current_x, start_y, w, max_h, 'FD')
+        else:
+            pdf.rect(current_x, start_y, w, max_h, 'D')
+        
+        # alinhamento
+        align = 'L'
+        if is_header:
+            align = 'C'
+        elif col_name in COLUNAS_CENTRALIZADAS:
+            align = 'C'
+        
+        # Fonte
+        if special_font:
+            pdf.set_font('Arial', '', font_size)
+        elif is_header:
+            pdf.set_font('Arial', 'B', 6)
+        else:
+            pdf.set_font('Arial', '', 6)
+        
+        # Posição Y (Centralizada ou Topo)
+        if not is_header and col_name in COLUNAS_ALINHADAS_TOPO:
+            y_offset = 0.5
+        else:
+            y_offset = (max_h - content_h) / 2
+        
+        # Renderizar Texto
+        pdf.set_xy(current_x, start_y + y_offset)
+        pdf.multi_cell(w, line_height, text, 0, align)
+        
+        current_x += w
+        
+    # Mover Y para fim da linha
+    pdf.set_y(start_y + max_h)
+    # Resetar fonte
+    pdf.set_font('Arial', '', 6)
+
+def registrar_fontes(pdf):
+    """Registra as fontes na mesma ordem em todo documento, para que /F1, /F2 coincidam entre eles."""
+    pdf.set_font('Arial', 'B', 6)
+    pdf.set_font('Arial', '', 6)
+
+def pdf_em_bytes(pdf):
+    """Fecha o documento e devolve o PDF em bytes."""
+    # Tratar retorno do fpdf que pode variar entre str e bytearray dependendo da versão/env
+    val = pdf.output(dest='S')
+    if isinstance(val, str):
+        return val.encode('latin-1')
+    return bytes(val)
+
+def gravar_pdf(criar, destino):
+    """
+    Grava em `destino` o documento criado por criar(arquivo), em modo contínuo (as páginas vão
+    para o arquivo à medida que ficam prontas). Usa um temporário, renomeado no fim. Devolve o caminho.
+    """
+    temp = f"{destino}.{os.getpid()}.tmp"
+    try:
+        with open(temp, 'wb') as arquivo:
+            criar(arquivo).close()
+        os.replace(temp, destino)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return destino
+
+def criar_livro(df, dados_escola, titulo_documento, arquivo=None):
+    """Documento do livro de matrículas já desenhado (ainda aberto); com `arquivo`, em gravação contínua."""
+    pdf = PDF(titulo_documento, dados_escola, arquivo)
+    registrar_fontes(pdf)
+    desenhar_livro(pdf, df)
+    return pdf
+
+def gerar_pdf_matricula(df, dados_escola, titulo_documento):
+    return pdf_em_bytes(criar_livro(df, dados_escola, titulo_documento))
+
+def gravar_pdf_matricula(df, dados_escola, titulo_documento, destino):
+    """Gera o livro direto no arquivo `destino`, sem devolver os bytes; devolve o caminho."""
+    return gravar_pdf(lambda arquivo: criar_livro(df, dados_escola, titulo_documento, arquivo), destino)
+
+def desenhar_livro(pdf, df):
+    """Desenha as páginas do livro de matrículas (todas as turmas) no documento PDF."""
+    dados_escola = pdf.dados_escola
+    titulo_documento = pdf.titulo_doc
+    # Configuração de Fonte reduzida para caber muitas colunas
+    pdf.set_font('Arial', 'B', 6)
+
+    # 1. Preparar Dados para o Relatório
+    # O DataFrame recebido não é copiado nem alterado. A ordem de cada turma é calculada
+    # só sobre as colunas-chave e a tabela exibida é montada uma única vez, já na ordem
+    # final; cada turma é um intervalo [inicio, fim) dessa tabela.
+
+    # Mapeamento de Colunas
+    mapa_colunas = mapa_colunas_relatorio(dados_escola.get('ano_letivo', ''))
     
     colunas_finais = list(mapa_colunas.values())
     
-    # Renomear/Criar
-    # Se 'Etnia/Raça' não existir no DF, criar vazia para evitar erro de Key
-    if 'Etnia/Raça' not in df_relatorio.columns:
-         df_relatorio['Etnia/Raça'] = ""
-         
-    df_relatorio.rename(columns=mapa_colunas, inplace=True)
-    
-    # Garantir Inteiros na coluna '#'
-    # if '#' in df_relatorio.columns: # Moved to inside group loop
-    #     df_relatorio['#'] = df_relatorio['#'].astype(int)
-        
     # Formatação de CPF (Máscara XXX.XXX.XXX-XX)
-    if 'CPF' in df_relatorio.columns:
+    cpf = None
+    if 'CPF' in df.columns:
         def formatar_cpf_mascara(valor):
             if pd.isnull(valor) or str(valor).strip() == "": return ""
             nums = "".join(filter(str.isdigit, str(valor)))
@@ -313,20 +853,91 @@ def gerar_pdf_matricula(df, dados_escola, titulo_documento):
             nums = nums.zfill(11) # Garante 11 digitos
             return f"{nums[:3]}.{nums[3:6]}.{nums[6:9]}-{nums[9:]}"
             
-        df_relatorio['CPF'] = df_relatorio['CPF'].apply(formatar_cpf_mascara)
+        cpf = df['CPF'].apply(formatar_cpf_mascara)
 
-    # Identificar Grupos (Turmas)
+    # Colunas-chave (turma, deduplicação e ordenação), indexadas pela posição no df
     col_turma = "Turma no Ano Selecionado"
-    grupos = []
-    
-    if col_turma in df_relatorio.columns:
-        # Ordenar para garantir agrupamento visual se necessário
-        # df_relatorio.sort_values(by=col_turma, inplace=True) # opcional, mas bom
-        # Agrupar
-        for nome_turma, df_group in df_relatorio.groupby(col_turma, sort=True):
-             grupos.append(df_group.copy())
+    col_data_sort = 'Data de Matrícula'
+    chaves = df[[c for c in (col_turma, col_data_sort, 'Ordenador', 'Nome') if c in df.columns]].reset_index(drop=True)
+    if cpf is not None:
+        chaves['CPF'] = cpf.to_numpy()
+
+    def sort_normalizer(series):
+        if series.name == 'Nome':
+            return series.astype(str).apply(
+                lambda x: unicodedata.normalize('NFKD', x).encode('ASCII', 'ignore').decode('utf-8').upper() if pd.notnull(x) else ""
+            )
+        return series
+
+    def ordenar_turma(chaves_turma):
+        """Posições (no df) das linhas da turma, deduplicadas por CPF e na ordem do livro."""
+        # --- Lógica de Deduplicação por CPF (Manter mais antiga) ---
+        # Usa a coluna original 'Data de Matrícula' (datetime do tratamento, sem novo parse aqui)
+        if 'CPF' in chaves_turma.columns and col_data_sort in chaves_turma.columns:
+             try:
+                 # Ordenar por data (Descendente = Mais Nova Primeiro)
+                 chaves_turma = chaves_turma.sort_values(by=col_data_sort, ascending=False)
+                 # Remover duplicatas de CPF, mantendo a primeira (mais nova)
+                 # Filtra apenas CPFs não nulos/vazios para evitar exclusão acidental de vazios distintos
+                 mask_cpf_valid = chaves_turma['CPF'].notna() & (chaves_turma['CPF'] != "")
+                 com_cpf = chaves_turma[mask_cpf_valid].drop_duplicates(subset=['CPF'], keep='first')
+                 # Recombina: primeiro os com CPF, depois os sem CPF
+                 chaves_turma = pd.concat([com_cpf, chaves_turma[~mask_cpf_valid]])
+             except Exception as e:
+                 logger.warning("Erro na deduplicação por CPF: %s", e)
+        
+        # Ordenação Final: Primeiro por 'Ordenador', depois por 'Nome'
+        cols_sort = [c for c in ('Ordenador', 'Nome') if c in chaves_turma.columns]
+        if cols_sort:
+            chaves_turma = chaves_turma.sort_values(
+                by=cols_sort, 
+                ascending=[True] * len(cols_sort), 
+                key=sort_normalizer
+            )
+        return chaves_turma.index.to_numpy()
+
+    # Identificar Grupos (Turmas): posições ordenadas e primeira linha (ordem original) de cada turma
+    if col_turma in chaves.columns:
+        grupos = chaves.groupby(col_turma, sort=True, observed=True)
     else:
-        grupos.append(df_relatorio.copy())
+        grupos = [(None, chaves)]
+    ordens = []
+    turmas = []
+    inicio = 0
+    for _, chaves_turma in grupos:
+        posicoes = ordenar_turma(chaves_turma)
+        ordens.append(posicoes)
+        primeira = chaves_turma.index[0] if len(chaves_turma) else None
+        turmas.append({'inicio': inicio, 'fim': inicio + len(posicoes), 'primeira': primeira})
+        inicio += len(posicoes)
+    ordem = np.concatenate(ordens) if ordens else np.array([], dtype=int)
+
+    # Tabela exibida (única cópia dos dados), já na ordem final de todas as turmas
+    colunas_tabela = {}
+    for origem, destino in mapa_colunas.items():
+        if origem == '#':
+            # Sequencial '#' reiniciado em cada turma
+            colunas_tabela[destino] = np.concatenate([np.arange(1, len(p) + 1) for p in ordens]) if ordens else []
+        elif origem == 'Pós Censo' and "EJA 2º SEM" in titulo_documento:
+            # Ajuste: Se for EJA 2º Semestre, fixar "Pós Censo" como "-"
+            colunas_tabela[destino] = "-"
+        elif origem == 'CPF' and cpf is not None:
+            colunas_tabela[destino] = cpf.iloc[ordem].reset_index(drop=True)
+        elif origem in df.columns:
+            colunas_tabela[destino] = df[origem].iloc[ordem].reset_index(drop=True)
+        else:
+            # Colunas ausentes no arquivo (ex: 'Etnia/Raça') ficam vazias
+            colunas_tabela[destino] = ""
+    # Datas formatadas para exibição
+    tabela = formatar_datas_relatorio(
+        pd.DataFrame(colunas_tabela, index=pd.RangeIndex(len(ordem)), columns=colunas_finais)
+    )
+
+    def valor_turma(turma, col):
+        """Valor da coluna na primeira linha (ordem original) da turma."""
+        if turma['primeira'] is None:
+            return None
+        return df[col].iloc[turma['primeira']]
         
     # --- Loop Principal de Geração ---
     
@@ -371,228 +982,63 @@ def gerar_pdf_matricula(df, dados_escola, titulo_documento):
     # Obs: Coluna '#' não está no map, então usará o próprio nome '#', o que é correto.
     headers_texto = [headers_map.get(col, col) for col in colunas_finais]
 
-    # Função Local para Print Row
-    def print_row(pdf_instance, data_values, widths, is_header=False):
-        line_height = 3 if is_header else 4
-        # Altura mínima: 2 linhas de texto (4 * 2 = 8mm) se for dados
-        min_h = 8 if not is_header else line_height
-        
-        start_y = pdf_instance.get_y()
-        start_x = pdf_instance.get_x()
-        
-        # Colunas com alinhamento central
-        center_cols = [
-            '#',
-            'Grupo/Ano/Fase', 
-            'Matrícula', 
-            'CPF', 
-            'Data de Nascimento', 
-            'Idade (31/03)', 
-            'Sexo', 
-            'Data Matrícula Suap', 
-            'PNE', 
-            'Pós Censo', 
-            'Data da situação'
-        ]
-        
-        # Passada 1: Calcular altura necessária (Line counting simulado)
-        cell_info = []
-        max_h = min_h
-        
-        for i, raw_val in enumerate(data_values):
-            text = fix_text(raw_val)
-            w = widths[i]
-            col_name = colunas_finais[i]
-            
-            # Lógica de fonte reduzida
-            current_font_size = 6
-            special_font = False
-            if not is_header:
-                txt_str = str(text)
-                if col_name == 'Nacionalidade' and 'Brasileira - Nascido no exterior' in txt_str:
-                     current_font_size = 5
-                     special_font = True
-                elif col_name in ['Filiação 1', 'Filiação 2'] and 'NÃO CONSTA' in txt_str:
-                     current_font_size = 5
-                     special_font = True
-            
-            # Setar fonte para medição
-            style = 'B' if is_header else ''
-            pdf_instance.set_font('Arial', style, current_font_size)
-            
-            # Ajuste de largura útil para cálculo de quebra de linha
-            c_margin = getattr(pdf_instance, 'c_margin', 1.0) # 1.0 default if missing, but usually ~0.35mm
-            effective_w = w - (2 * c_margin)
-            if effective_w < 0: effective_w = 0.1 # defensive
-            
-            # Contar linhas
-            if not text:
-                num_lines = 1
-            else:
-                num_lines = 0
-                lines = text.split('\n')
-                space_w = pdf_instance.get_string_width(' ')
-                
-                for line in lines:
-                    if not line:
-                        num_lines += 1
-                        continue
-                    
-                    words = line.split(' ')
-                    curr_line_w = 0
-                    # Palavra por palavra
-                    for idx_w, word in enumerate(words):
-                        word_w = pdf_instance.get_string_width(word)
-                        # Se primeira palavra (e cabe na largura ou é maior que largura total)
-                        if curr_line_w == 0:
-                            if word_w > effective_w:
-                                # Palavra maior que a célula (vai quebrar?)
-                                # FPDF normalmente imprime e estoura se for maior que w, mas MultiCell força wrap?
-                                # Assumindo wrap conservador.
-                                wrap_count = math.ceil(word_w / effective_w)
-                                num_lines += wrap_count if wrap_count > 0 else 1
-                                curr_line_w = 0 
-                            else:
-                                curr_line_w = word_w
-                        else:
-                            if curr_line_w + space_w + word_w > effective_w:
-                                # Quebra linha
-                                num_lines += 1
-                                curr_line_w = word_w
-                            else:
-                                curr_line_w += space_w + word_w
-                    num_lines += 1
-            
-            # Calcular altura desta celula
-            cell_h = num_lines * line_height
-            if cell_h > max_h:
-                max_h = cell_h
-            
-            cell_info.append({
-                'text': text,
-                'w': w,
-                'h': cell_h,
-                'special_font': special_font,
-                'font_size': current_font_size
-            })
-
-        # Restaurar fonte padrão
-        pdf_instance.set_font('Arial', '', 6)
-
-        # Checar Page Break Manual se a linha for muito alta (opcional, FPDF lida com multi_cell mas aqui desenhamos rect)
-        # Se start_y estiver muito embaixo, add_page.
-        page_h = 210
-        margin_b = 10
-        if start_y + max_h > page_h - margin_b:
-             pdf_instance.add_page()
-             if is_header:
-                  # Se for header e quebrou página, reseta Y?
-                  # print_table_header lida com isso se start_y for novo.
-                  pass
-             start_y = pdf_instance.get_y()
-             start_x = pdf_instance.get_x()
-
-        # Passada 2: Desenhar
-        current_x = start_x
-        
-        for i, info in enumerate(cell_info):
-            w = info['w']
-            text = info['text']
-            
-            # Desenhar Borda/Fundo
-            if is_header:
-                pdf_instance.set_fill_color(220, 220, 220)
-                pdf_instance.rect(current_x, start_y, w, max_h, 'FD')
-            else:
-                pdf_instance.rect(current_x, start_y, w, max_h, 'D')
-            
-            # alinhamento
-            align = 'L'
-            col_name = colunas_finais[i]
-            if is_header:
-                align = 'C'
-            elif col_name in center_cols:
-                align = 'C'
-            
-            # Fonte
-            if info['special_font']:
-                pdf_instance.set_font('Arial', '', info['font_size'])
-            elif is_header:
-                pdf_instance.set_font('Arial', 'B', 6)
-            else:
-                pdf_instance.set_font('Arial', '', 6)
-            
-            # Posição Y (Centralizada ou Topo)
-            content_h = info['h']
-            top_align_cols = ['Nome', 'Filiação 1', 'Filiação 2', 'Naturalidade', 'Nacionalidade', 'Situação']
-            
-            if not is_header and col_name in top_align_cols:
-                y_offset = 0.5
-            else:
-                y_offset = (max_h - content_h) / 2
-            
-            # Renderizar Texto
-            pdf_instance.set_xy(current_x, start_y + y_offset)
-            pdf_instance.multi_cell(w, line_height, text, 0, align)
-            
-            current_x += w
-            
-        # Mover Y para fim da linha
-        pdf_instance.set_y(start_y + max_h)
-        # Resetar fonte
-        pdf_instance.set_font('Arial', '', 6)
+    # Layout do cabeçalho da tabela (o mesmo em todas as páginas)
+    medidor = criar_medidor()
+    celulas_header, alturas_header = calcular_layout(
+        medidor, [[h] for h in headers_texto], colunas_finais, larguras_lista, pdf.c_margin, is_header=True
+    )
+    altura_header = alturas_header[0]
+    # Espaço da tabela em cada página: do fim do cabeçalho da página até a margem inferior
+    altura_disponivel = pdf.altura_livro - PDF.MARGEM_INFERIOR - PDF.Y_INICIO_TABELA
 
     # Função para desenhar o cabeçalho da tabela
     def print_table_header():
         pdf.set_font('Arial', 'B', 6)
         pdf.set_fill_color(220, 220, 220)
-        print_row(pdf, headers_texto, larguras_lista, is_header=True)
+        desenhar_linha(pdf, celulas_header[0], colunas_finais, larguras_lista, altura_header, is_header=True)
         pdf.set_font('Arial', '', 6)
 
     # --- Iterar sobre Grupos ---
-    for df_grupo in grupos:
+    for turma in turmas:
         # Preparar Header Dinâmico para este grupo
         header_info = {}
-        
+    
         # 0. Turma
-        if col_turma in df_grupo.columns:
-            val = df_grupo[col_turma].iloc[0]
+        if col_turma in df.columns:
+            val = valor_turma(turma, col_turma)
             header_info['turma'] = str(val) if pd.notna(val) else ""
         else:
             header_info['turma'] = "Única"
-            
+        
         # 1. Matriz
         # Tenta 'Matriz' primeiro, depois 'Curso' (que pode ser a matriz mapeada no DEPARA ou original)
-        # Note: 'Matriz' pode ter sido renomeada para 'Matriz' se existia e mapeamos?
-        # Verificando mapa_colunas: 'Curso': 'Matriz' foi comentado/tentado.
-        # Vamos checar colunas disponíveis.
         matriz_val = ""
-        if 'Matriz' in df_grupo.columns:
-             matriz_val = df_grupo['Matriz'].iloc[0]
-        elif 'Curso' in df_grupo.columns:
-             matriz_val = df_grupo['Curso'].iloc[0]
+        if 'Matriz' in df.columns:
+             matriz_val = valor_turma(turma, 'Matriz')
+        elif 'Curso' in df.columns:
+             matriz_val = valor_turma(turma, 'Curso')
         header_info['matriz'] = str(matriz_val) if pd.notna(matriz_val) else ""
-             
+         
         # 2. Data Base Censo (Fixo)
         header_info['data_censo'] = dados_escola.get('data_censo', '')
-        
+    
         # 3. Regra de Datas e Dias
         # Determinar contexto (Botão 1 ou 2)
         is_btn_2 = "EJA 2º SEM" in titulo_documento
-        
+    
         # Determinar Fase EJA
         desc_curso = ""
-        if 'Descrição do Curso' in df_grupo.columns:
-             desc_curso = str(df_grupo['Descrição do Curso'].iloc[0])
-        
+        if 'Descrição do Curso' in df.columns:
+             desc_curso = str(valor_turma(turma, 'Descrição do Curso'))
+    
         # Normalizar string para comparação segura
         eja_phases = ['Educação de Jovens e Adultos Fases Finais', 'Educação de Jovens e Adultos Fases Iniciais']
         # Remover espaços extras se houver
         is_eja_phase = desc_curso.strip() in eja_phases
-        
+    
         enc_final = ""
         dias_final = ""
-        
+    
         # Regra 1 e 2
         if is_btn_2:
             # Botão 2 (EJA 2)
@@ -608,114 +1054,88 @@ def gerar_pdf_matricula(df, dados_escola, titulo_documento):
              else:
                  enc_final = dados_escola.get('data_encerramento')
                  dias_final = dados_escola.get('total_dias_letivos')
-                 
+             
         header_info['data_encerramento'] = enc_final
         header_info['dias_letivos'] = dias_final
         # Armazenar Descrição do Curso para uso no Cabeçalho
         header_info['descricao_curso'] = desc_curso
-        
+    
         # Setar no objeto PDF
         pdf.current_header_info = header_info
 
-        # Preparar DF do Grupo
-        
-        # --- Lógica de Deduplicação por CPF (Manter mais antiga) ---
-        # Ajuste: A coluna 'Data Matrícula Suap' foi removida da exibição/mapeamento, 
-        # então usamos a coluna original 'Data de Matrícula' que deve estar no DF.
-        col_data_sort = 'Data de Matrícula'
-        if 'CPF' in df_grupo.columns and col_data_sort in df_grupo.columns:
-             try:
-                 # Criar coluna temporária de data para ordenação
-                 df_grupo['__data_sort'] = pd.to_datetime(df_grupo[col_data_sort], dayfirst=True, errors='coerce')
-                 # Ordenar por data (Descendente = Mais Nova Primeiro)
-                 df_grupo.sort_values(by='__data_sort', ascending=False, inplace=True)
-                 # Remover duplicatas de CPF, mantendo a primeira (mais nova)
-                 # Filtra apenas CPFs não nulos/vazios para evitar exclusão acidental de vazios distintos
-                 mask_cpf_valid = df_grupo['CPF'].notna() & (df_grupo['CPF'] != "")
-                 
-                 # Separa dados com CPF e sem CPF
-                 df_com_cpf = df_grupo[mask_cpf_valid].copy()
-                 df_sem_cpf = df_grupo[~mask_cpf_valid].copy()
-                 
-                 # Remove dups nos com CPF
-                 df_com_cpf.drop_duplicates(subset=['CPF'], keep='first', inplace=True)
-                 
-                 # Recombina (mantendo ordem de data se possível, ou reordenando por nome depois se desejado)
-                 df_grupo = pd.concat([df_com_cpf, df_sem_cpf], ignore_index=True)
-                 
-             except Exception as e:
-                 # Logar erro se necessário, ou pass silenciosamente mantendo dados
-                 print(f"Erro na deduplicação: {e}")
-                 pass
+        # 4. Layout e Paginação do Grupo (pela altura real das linhas)
+        # Textos só do intervalo [inicio, fim) da turma (já ordenado, deduplicado e formatado),
+        # convertidos por coluna e descartados ao fim da turma
+        fatia = tabela.iloc[turma['inicio']:turma['fim']]
+        valores_turma = [textos_coluna(fatia[col]) for col in colunas_finais]
+        celulas, alturas = calcular_layout(medidor, valores_turma, colunas_finais, larguras_lista, pdf.c_margin)
         
-        # Ordenação Final: Primeiro por 'Ordenador', depois por 'Nome'
-        cols_sort = []
-        # Verifica se colunas existem antes de ordenar
-        if 'Ordenador' in df_grupo.columns:
-            # Garantir que Ordenador seja numérico ou string comparável consistentemente
-            # Tentar converter para numérico se for o caso
-            # df_grupo['Ordenador'] = pd.to_numeric(df_grupo['Ordenador'], errors='ignore') 
-            cols_sort.append('Ordenador')
-            
-        if 'Nome' in df_grupo.columns:
-            cols_sort.append('Nome')
-            
-        if cols_sort:
-            def sort_normalizer(series):
-                if series.name == 'Nome':
-                    return series.astype(str).apply(
-                        lambda x: unicodedata.normalize('NFKD', x).encode('ASCII', 'ignore').decode('utf-8').upper() if pd.notnull(x) else ""
-                    )
-                return series
-                
-            df_grupo.sort_values(
-                by=cols_sort, 
-                ascending=[True] * len(cols_sort), 
-                inplace=True,
-                key=sort_normalizer
-            )
-            
-        # 1. Resetar Sequencial '#'
-        if '#' in df_grupo.columns: df_grupo.drop(columns=['#'], inplace=True)
-        df_grupo.insert(0, '#', range(1, len(df_grupo) + 1))
-        df_grupo['#'] = df_grupo['#'].astype(int)
-        
-        # 2. Preencher Colunas Faltantes
-        for col_final in colunas_finais:
-            if col_final not in df_grupo.columns:
-                df_grupo[col_final] = ""
-        
-        # 3. Filtrar
-        df_sub = df_grupo[colunas_finais]
-        
-        # 4. Paginação do Grupo
-        registros_por_pagina = 15
-        total_registros = len(df_sub)
-        
-        for i in range(0, total_registros, registros_por_pagina):
-            chunk = df_sub.iloc[i : i + registros_por_pagina]
-            
+        for inicio, fim in paginar(alturas, altura_header, altura_disponivel):
             pdf.add_page()
             
             # Header da Tabela
             print_table_header()
             
             # Rows
-            for _, row in chunk.iterrows():
-                row_values = [str(row[col]) for col in colunas_finais]
-                print_row(pdf, row_values, larguras_lista, is_header=False)
+            for i in range(inicio, fim):
+                desenhar_linha(pdf, celulas[i], colunas_finais, larguras_lista, alturas[i])
+        del fatia, valores_turma, celulas, alturas
 
-    # Tratar retorno do fpdf que pode variar entre str e bytearray dependendo da versão/env
-    val = pdf.output(dest='S')
-    if isinstance(val, str):
-        return val.encode('latin-1')
-    return bytes(val)
+# Documentos de uma escola em uma única chamada
+# Capa, termos e livro compartilham o brasão decodificado e as fontes.
+# Encadernado, tudo vai em um só PDF (capa + abertura + livro + encerramento): imagem e
+# fontes são gravadas uma única vez e o arquivo sai pronto para impressão.
+def criar_encadernado(df, dados_escola, titulo_documento, arquivo=None):
+    """Documento encadernado (capa, termo de abertura, livro e termo de encerramento) já desenhado."""
+    pdf = PDF(titulo_documento, dados_escola, arquivo)
+    registrar_fontes(pdf)
+    pdf.pagina_avulsa(desenhar_capa)
+    pdf.pagina_avulsa(desenhar_termo_abertura)
+    desenhar_livro(pdf, df)
+    pdf.pagina_avulsa(desenhar_termo_encerramento)
+    return pdf
+
+def gravar_documentos_encadernados(df, dados_escola, titulo_documento, destino):
+    """Grava o PDF encadernado da escola em `destino`; devolve o caminho."""
+    return gravar_pdf(lambda arquivo: criar_encadernado(df, dados_escola, titulo_documento, arquivo), destino)
+
+def gerar_documentos(df, dados_escola, titulo_documento="Livro de Matrículas", encadernado=False):
+    """
+    Gera os documentos da escola: {'capa', 'abertura', 'livro', 'encerramento'} -> bytes,
+    ou os bytes de um único PDF encadernado quando encadernado=True.
+    """
+    if encadernado:
+        return pdf_em_bytes(criar_encadernado(df, dados_escola, titulo_documento))
+    return {
+        'capa': gerar_capa(dados_escola),
+        'abertura': gerar_termo_abertura(dados_escola),
+        'livro': gerar_pdf_matricula(df, dados_escola, titulo_documento),
+        'encerramento': gerar_termo_encerramento(dados_escola)
+    }
+
+# Campos de dados_escola lidos pela capa e pelos termos. Servem de chave de cache:
+# mudar os demais campos (datas do censo, EJA, dias letivos) não altera esses PDFs.
+CAMPOS_TERMOS = ('nome', 'inep', 'ano_letivo', 'logradouro', 'numero', 'bairro', 'cep', 'telefone', 'email')
+CAMPOS_DOCUMENTOS = {
+    'capa': ('nome', 'ano_letivo'),
+    'abertura': CAMPOS_TERMOS,
+    'encerramento': CAMPOS_TERMOS
+}
+
+def campos_documento(tipo, dados_escola):
+    """Pares (campo, valor) de dados_escola usados pelo documento, em tupla (hashable)."""
+    return tuple((campo, dados_escola[campo]) for campo in CAMPOS_DOCUMENTOS[tipo] if campo in dados_escola)
 
 def gerar_capa(dados_escola):
     """Gera a capa do Livro de Matrículas em PDF"""
     pdf = FPDF(orientation='P', unit='mm', format='A4')
     pdf.set_auto_page_break(auto=False)
     pdf.add_page()
+    desenhar_capa(pdf, dados_escola)
+    return pdf_em_bytes(pdf)
+
+def desenhar_capa(pdf, dados_escola):
+    """Desenha a capa na página atual (retrato A4)."""
     
     # Configurações da Página
     page_width = 210
@@ -739,19 +1159,12 @@ def gerar_capa(dados_escola):
     # Centralizar imagem. Tamanho sugerido: 30x30mm
     logo_w = 30
     logo_h = 30
-    try:
-        # Centralizar na área útil (respeitando margens)
-        # x_img = pdf.l_margin + (pdf.epw - logo_w) / 2
-        # Ou manter centralizado na PÁGINA se for preferência? O texto usa cell(0) que respeita margens.
-        # Vamos centralizar na PÁGINA para ficar simétrico visualmente no papel ou na área útil? 
-        # Geralmente capa se centraliza no papel, mas com margem esquerda maior (encadernação), o centro visual muda.
-        # Vou centralizar na área útil para alinhar com o texto.
-        x_img = margin_left + (page_width - margin_left - margin_right - logo_w) / 2
-        pdf.image('brasao.png', x=x_img, y=y_cursor, w=logo_w, h=logo_h)
-        y_cursor += logo_h + 5
-    except:
-        # Se falhar imagem, apenas pula
-        y_cursor += 10
+    # Centralizar na área útil (respeitando margens)
+    # Geralmente capa se centraliza no papel, mas com margem esquerda maior (encadernação), o centro visual muda.
+    # Vou centralizar na área útil para alinhar com o texto.
+    x_img = margin_left + (page_width - margin_left - margin_right - logo_w) / 2
+    inserir_imagem(pdf, x_img, y_cursor, logo_w, logo_h)
+    y_cursor += logo_h + 5
         
     # 3. Textos Institucionais
     pdf.set_font('Arial', 'B', 14)
@@ -784,17 +1197,17 @@ def gerar_capa(dados_escola):
     pdf.set_y(y_cursor)
     pdf.set_font('Arial', 'B', 26)
     pdf.cell(0, 15, titulo, 0, 1, 'C')
-    
-    val = pdf.output(dest='S')
-    if isinstance(val, str):
-        return val.encode('latin-1')
-    return bytes(val)
 
 def gerar_termo_abertura(dados_escola):
     """Gera o Termo de Abertura em PDF"""
     pdf = FPDF(orientation='P', unit='mm', format='A4')
     pdf.set_auto_page_break(auto=False)
     pdf.add_page()
+    desenhar_termo_abertura(pdf, dados_escola)
+    return pdf_em_bytes(pdf)
+
+def desenhar_termo_abertura(pdf, dados_escola):
+    """Desenha o Termo de Abertura na página atual (retrato A4)."""
     
     # Configurações da Página
     page_width = 210
@@ -845,11 +1258,8 @@ def gerar_termo_abertura(dados_escola):
     # 1. Logo
     h_row1 = 20
     logo_size = 12.8
-    try:
-         # Alinhar logo à esquerda (x_start) para ficar igual à linha 2
-         pdf.image('brasao.png', x_start, y_start + 2, logo_size, logo_size)
-    except:
-         pass
+    # Alinhar logo à esquerda (x_start) para ficar igual à linha 2
+    inserir_imagem(pdf, x_start, y_start + 2, logo_size, logo_size)
          
     # 2. Institucional (Ocupando o resto da linha 1)
     # w_col2 agora ocupa todo o espaço restante pois a escola desceu
@@ -989,17 +1399,17 @@ def gerar_termo_abertura(dados_escola):
     
     pdf.set_xy(x_sig2, y_sig + 2)
     pdf.cell(col_width, 5, fix_text("Pedagogo Supervisor"), 0, 0, 'C')
-    
-    val = pdf.output(dest='S')
-    if isinstance(val, str):
-        return val.encode('latin-1')
-    return bytes(val)
 
 def gerar_termo_encerramento(dados_escola):
     """Gera o Termo de Encerramento em PDF"""
     pdf = FPDF(orientation='P', unit='mm', format='A4')
     pdf.set_auto_page_break(auto=False)
     pdf.add_page()
+    desenhar_termo_encerramento(pdf, dados_escola)
+    return pdf_em_bytes(pdf)
+
+def desenhar_termo_encerramento(pdf, dados_escola):
+    """Desenha o Termo de Encerramento na página atual (retrato A4)."""
     
     # Configurações da Página
     page_width = 210
@@ -1034,11 +1444,8 @@ def gerar_termo_encerramento(dados_escola):
     # 1. Logo
     h_row1 = 20
     logo_size = 12.8
-    try:
-         # Alinhar logo à esquerda (x_start)
-         pdf.image('brasao.png', x_start, y_start + 2, logo_size, logo_size)
-    except:
-         pass
+    # Alinhar logo à esquerda (x_start)
+    inserir_imagem(pdf, x_start, y_start + 2, logo_size, logo_size)
          
     # 2. Institucional (Ocupando o resto da linha 1)
     w_col2 = usable_width - w_col1
@@ -1150,8 +1557,3 @@ def gerar_termo_encerramento(dados_escola):
     
     pdf.set_xy(x_sig2, y_sig + 2)
     pdf.cell(col_width, 5, fix_text("Pedagogo Supervisor"), 0, 0, 'C')
-    
-    val = pdf.output(dest='S')
-    if isinstance(val, str):
-        return val.encode('latin-1')
-    return bytes(val)
\ No newline at end of file
@@ -0,0 +1,50 @@
+import os
+import re
+import zlib
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(autouse=True)
+def pasta_projeto(monkeypatch):
+    """Os módulos leem brasao.png, municipios.csv e DEPARA.csv por caminho relativo à raiz do projeto."""
+    monkeypatch.chdir(RAIZ)
+
+def fluxos(pdf_bytes, padrao):
+    texto = pdf_bytes.decode('latin-1')
+    return [zlib.decompress(conteudo.encode('latin-1')).decode('latin-1') for conteudo in re.findall(padrao, texto, re.S)]
+
+def objetos_pdf(pdf_bytes):
+    """{número: bytes do objeto}, localizados pelo xref (cada offset precisa apontar para o seu objeto)."""
+    inicio_xref = int(re.search(rb'startxref\n(\d+)\n%%EOF', pdf_bytes).group(1))
+    linhas = pdf_bytes[inicio_xref:].split(b'\n')
+    assert linhas[0] == b'xref'
+    total = int(linhas[1].split()[1])
+    offsets = [int(linha[:10]) for linha in linhas[3:2 + total]]  # linhas[2] é o objeto 0 (livre)
+    limites = sorted(offsets) + [inicio_xref]
+    objetos = {}
+    for numero, offset in enumerate(offsets, start=1):
+        objeto = pdf_bytes[offset:limites[limites.index(offset) + 1]]
+        assert objeto.startswith(b'%d 0 obj\n' % numero)
+        objetos[numero] = objeto
+    return objetos
+
+def conteudo_paginas(pdf_bytes):
+    """Conteúdo (descomprimido) de cada página de um PDF gerado pelo fpdf, na ordem das páginas."""
+    # Só as páginas têm '<</Filter /FlateDecode /Length' (a imagem tem /DecodeParms antes do
+    # /Length e nos modelos o /Filter vem depois do /BBox). Na gravação contínua a ordem no
+    # arquivo pode não ser a das páginas, então os objetos vão pela numeração (2+2n).
+    return fluxos(
+        b''.join(objeto for _, objeto in sorted(objetos_pdf(pdf_bytes).items())),
+        r'<</Filter /FlateDecode /Length \d+>>\nstream\n(.*?)\nendstream'
+    )
+
+def conteudo_modelos(pdf_bytes):
+    """{nome: conteúdo descomprimido} dos modelos (Form XObjects) de cabeçalho e rodapé."""
+    nomes = re.findall(rb'/Tpl(\w+) \d+ 0 R', pdf_bytes)
+    conteudos = fluxos(pdf_bytes, r'/Subtype /Form [^>]*/Length \d+>>\nstream\n(.*?)\nendstream')
+    return dict(zip((n.decode() for n in nomes), conteudos))
+
+def sem_data_criacao(pdf_bytes):
+    """PDF sem a /CreationDate (muda a cada geração), para comparar dois documentos."""
+    return re.sub(rb'/CreationDate \(D:\d+\)', b'', pdf_bytes)
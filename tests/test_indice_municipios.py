@@ -0,0 +1,52 @@
+import os
+import pandas as pd
+import pytest
+
+import indice_municipios as im
+
+@pytest.fixture
+def csv_municipios(tmp_path):
+    caminho = tmp_path / 'municipios.csv'
+    # 'Bom Jesus' existe em mais de uma UF: vale a última do CSV
+    caminho.write_text("Município,UF\nGoiana,PE\nSao Paulo,SP\nBom Jesus,PI\nBom Jesus,RS\n", encoding='utf-8')
+    return str(caminho)
+
+@pytest.mark.parametrize('entrada, esperado', [
+    ('Goiana', 'Goiana(PE)'),
+    ('Goiana (BA)', 'Goiana(BA)'),        # UF válida digitada é mantida, mesmo diferente da do índice
+    ('Goiana (pe)', 'Goiana(PE)'),
+    ('São Paulo', 'São Paulo(SP)'),       # busca sem acentos
+    ('  SAO PAULO ', 'SAO PAULO(SP)'),
+    ('bom jesus', 'bom jesus(RS)'),
+    ('Lugar Nenhum (XX)', 'Lugar Nenhum'),  # UF inválida e município fora do índice
+    (None, ''),
+])
+def test_tratar_naturalidade(csv_municipios, entrada, esperado):
+    indice = im.montar_indice(csv_municipios)
+    assert im.tratar_naturalidade(pd.Series([entrada]), indice).tolist() == [esperado]
+
+def test_tratar_naturalidade_sem_indice():
+    serie = pd.Series(['Goiana', 'Goiana (BA)', None], index=[10, 20, 30])
+    resultado = im.tratar_naturalidade(serie, None)
+    assert resultado.tolist() == ['Goiana', 'Goiana(BA)', '']
+    assert resultado.index.tolist() == [10, 20, 30]
+
+def test_carregar_indice_persistido(csv_municipios, tmp_path, monkeypatch):
+    caminho_indice = str(tmp_path / 'cache' / 'municipios.pkl')
+    chaves, ufs = im.carregar_indice(csv_municipios, caminho_indice)
+    assert os.path.exists(caminho_indice)
+
+    # Segunda carga vem do arquivo, sem ler o CSV
+    def falhar(*args):
+        raise AssertionError('CSV relido')
+    monkeypatch.setattr(im, 'montar_indice', falhar)
+    recarregado = im.carregar_indice(csv_municipios, caminho_indice)
+    assert recarregado[0].equals(chaves) and recarregado[1].equals(ufs)
+
+def test_carregar_indice_remonta_quando_csv_muda(csv_municipios, tmp_path):
+    caminho_indice = str(tmp_path / 'municipios.pkl')
+    im.carregar_indice(csv_municipios, caminho_indice)
+    with open(csv_municipios, 'a', encoding='utf-8') as f:
+        f.write("Campos dos Goytacazes,RJ\n")
+    indice = im.carregar_indice(csv_municipios, caminho_indice)
+    assert im.tratar_naturalidade(pd.Series(['Campos dos Goytacazes']), indice).tolist() == ['Campos dos Goytacazes(RJ)']
@@ -0,0 +1,154 @@
+import io
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import ingestao
+import tratamento
+
+@pytest.fixture
+def pasta_cache(tmp_path, monkeypatch):
+    pasta = tmp_path / 'uploads'
+    pasta.mkdir()
+    monkeypatch.setattr(ingestao, 'PASTA_CACHE', str(pasta))
+    return pasta
+
+def planilha_suap():
+    """.xlsx com uma data em célula de data, uma data em texto e a matrícula numérica."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Matrícula', 'Nome', 'Data de Nascimento', 'Coluna Descartada'])
+    ws.append([2025001, 'ANA', datetime(2010, 2, 1), 'x'])
+    ws.append([2025002, 'BRUNO', '15/03/2011', 'y'])
+    ws.append([None, None, None, None])
+    conteudo = io.BytesIO()
+    wb.save(conteudo)
+    return conteudo.getvalue()
+
+# Cache em Parquet
+
+def test_caminho_cache_inclui_versao(pasta_cache):
+    assert ingestao.caminho_cache('abc') == os.path.join(str(pasta_cache), f'abc_{ingestao.VERSAO_CACHE}.parquet')
+
+def test_versao_cache_depende_das_colunas_e_da_leitura():
+    esperado = ingestao.hash_conteudo(f"{'|'.join(ingestao.COLUNAS_SUAP)}|{ingestao.VERSAO_LEITURA}".encode('utf-8'))[:8]
+    assert ingestao.VERSAO_CACHE == esperado
+    assert ingestao.hash_conteudo(f"{'|'.join(ingestao.COLUNAS_SUAP)}|{ingestao.VERSAO_LEITURA + 1}".encode('utf-8'))[:8] != esperado
+
+def test_gravar_e_ler_cache(pasta_cache):
+    df = pd.DataFrame({'Matrícula': ['1', np.nan], 'Nome': ['ANA', 'BRUNO']})
+    ingestao.gravar_cache('chave', df)
+    lido = ingestao.ler_cache('chave')
+    pd.testing.assert_frame_equal(lido, df)
+    assert lido['Matrícula'].tolist()[1] is not None  # o Parquet devolve None; o cache devolve NaN
+    assert [p.name for p in pasta_cache.iterdir()] == [os.path.basename(ingestao.caminho_cache('chave'))]
+
+def test_cache_de_outra_versao_nao_e_lido(pasta_cache, monkeypatch):
+    ingestao.gravar_cache('chave', pd.DataFrame({'Nome': ['ANA']}))
+    monkeypatch.setattr(ingestao, 'VERSAO_CACHE', 'outra')
+    assert ingestao.ler_cache('chave') is None
+
+def test_cache_corrompido_e_ignorado(pasta_cache):
+    with open(ingestao.caminho_cache('chave'), 'wb') as f:
+        f.write(b'nao e parquet')
+    assert ingestao.ler_cache('chave') is None
+
+def test_limpar_cache_remove_os_menos_usados(pasta_cache):
+    df = pd.DataFrame({'Nome': ['ANA'] * 100})
+    for i, chave in enumerate(['antiga', 'media', 'nova']):
+        ingestao.gravar_cache(chave, df)
+        os.utime(ingestao.caminho_cache(chave), (1000 + i, 1000 + i))
+    tamanho = os.path.getsize(ingestao.caminho_cache('nova'))
+    ingestao.limpar_cache(tamanho_max=2 * tamanho)
+    assert ingestao.ler_cache('antiga') is None
+    assert ingestao.ler_cache('media') is not None and ingestao.ler_cache('nova') is not None
+
+def test_excel_lido_uma_vez(pasta_cache, monkeypatch):
+    conteudo = planilha_suap()
+    primeira = ingestao.ler_arquivo_com_cache(conteudo, 'suap.xlsx', 'chave')
+
+    def falhar(*args):
+        raise AssertionError('planilha relida')
+    monkeypatch.setattr(ingestao, 'ler_arquivo', falhar)
+    pd.testing.assert_frame_equal(ingestao.ler_arquivo_com_cache(conteudo, 'suap.xlsx', 'chave'), primeira)
+
+def test_tratamento_igual_com_e_sem_cache(pasta_cache):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Matrícula', 'Nome', 'Situação no Ano Selecionado', 'Descrição do Curso', 'Período no Ano Selecionado'])
+    ws.append([2025001, 'ANA', 'Aprovado', 'Educação Infantil', 1])
+    ws.append([2025002, 'BRUNO', None, None, None])
+    conteudo = io.BytesIO()
+    wb.save(conteudo)
+
+    primeira = tratamento.tratar_dados(ingestao.ler_arquivo_com_cache(conteudo.getvalue(), 'suap.xlsx', 'chave'), 2025, None)
+    do_cache = tratamento.tratar_dados(ingestao.ler_arquivo_com_cache(conteudo.getvalue(), 'suap.xlsx', 'chave'), 2025, None)
+    pd.testing.assert_frame_equal(do_cache, primeira)
+    # Nulos continuam nulos (e não os textos 'None'/'nan')
+    for df in (primeira, do_cache):
+        assert df['Situação no Ano Selecionado'].isna().tolist() == [False, True]
+        assert df['Descrição do Curso'].isna().tolist() == [False, True]
+
+# Leitura de planilhas
+
+def test_excel_datas_e_identificadores_como_texto():
+    df = ingestao.ler_arquivo(planilha_suap(), 'suap.xlsx')
+    assert list(df.columns) == ['Matrícula', 'Nome', 'Data de Nascimento']
+    assert df['Matrícula'].tolist() == ['2025001', '2025002']
+    assert df['Data de Nascimento'].tolist() == ['01/02/2010', '15/03/2011']
+
+def planilha_com_celulas_vazias():
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Matrícula', 'Nome', 'Data de Nascimento'])
+    ws.append([2025001, 'ANA', datetime(2010, 2, 1)])
+    ws.append([None, 'BRUNO', None])
+    ws.append([2025003, None, '15/03/2011'])
+    conteudo = io.BytesIO()
+    wb.save(conteudo)
+    return conteudo.getvalue()
+
+@pytest.mark.skipif(ingestao.MOTOR_EXCEL != 'calamine', reason='python-calamine não instalado')
+def test_leitores_excel_equivalentes():
+    conteudo = planilha_com_celulas_vazias()
+    calamine = ingestao.ler_excel_calamine(conteudo)
+    openpyxl = ingestao.ler_xlsx_streaming(conteudo)
+    pd.testing.assert_frame_equal(openpyxl, calamine)
+    # Células vazias como NaN nos dois leitores (o assert_frame_equal aceita None no lugar de NaN)
+    for df in (calamine, openpyxl):
+        assert df.isna().values.sum() == 3
+        assert not df.map(lambda valor: valor is None).values.any()
+
+# CSV em blocos
+
+def tratar_categorias(df):
+    """Tratamento de teste: como o do livro, devolve colunas category e registra avisos no bloco."""
+    df = df[df['Nome'] != 'REMOVIDO'].copy()
+    df['Turma no Ano Selecionado'] = df['Turma no Ano Selecionado'].astype('category')
+    avisos = {}
+    ingestao.acumular_aviso(avisos, 'Turma vazia', int(df['Turma no Ano Selecionado'].isna().sum()))
+    ingestao.acumular_aviso(avisos, 'Arquivo sem CPF')
+    df.attrs['avisos_tratamento'] = avisos
+    return df
+
+def test_csv_em_blocos_mantem_categorias():
+    csv = (
+        "Nome,Turma no Ano Selecionado,Coluna Descartada\n"
+        "ANA,1A,x\nBRUNO,1B,x\nREMOVIDO,9Z,x\nCARLA,,x\nDANI,2C,x\nEDU,1A,x\n"
+    ).encode('utf-8')
+    em_blocos = ingestao.ler_csv_em_blocos(csv, tratar_categorias, linhas_por_bloco=2)
+    inteiro = tratar_categorias(ingestao.ler_arquivo(csv, 'suap.csv'))
+
+    assert isinstance(em_blocos['Turma no Ano Selecionado'].dtype, pd.CategoricalDtype)
+    assert list(em_blocos['Turma no Ano Selecionado'].cat.categories) == ['1A', '1B', '2C']
+    assert 'Coluna Descartada' not in em_blocos.columns
+    pd.testing.assert_frame_equal(em_blocos, inteiro.reset_index(drop=True))
+    # Avisos dos blocos somados (quantidades) ou registrados uma vez (sem quantidade)
+    assert em_blocos.attrs['avisos_tratamento'] == {'Turma vazia': 1, 'Arquivo sem CPF': None}
+
+def test_csv_em_blocos_vazio():
+    resultado = ingestao.ler_csv_em_blocos(b"Nome,Turma no Ano Selecionado\n", tratar_categorias, linhas_por_bloco=2)
+    assert resultado.empty
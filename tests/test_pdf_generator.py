@@ -0,0 +1,210 @@
+import os
+import re
+import struct
+import zlib
+import pandas as pd
+import pytest
+from fpdf import FPDF, FPDF_VERSION
+
+import pdf_generator as pg
+from conftest import conteudo_paginas, conteudo_modelos, objetos_pdf, sem_data_criacao
+
+DADOS_ESCOLA = {'nome': 'Escola Teste', 'inep': '33012345', 'ano_letivo': 2025}
+
+def livro_exemplo(linhas=150):
+    """DataFrame mínimo do livro: duas turmas, linhas suficientes para várias páginas."""
+    return pd.DataFrame({
+        'Nome': [f'ALUNO {i:04d}' for i in range(linhas)],
+        'Turma no Ano Selecionado': ['1A' if i % 2 else '1B' for i in range(linhas)]
+    })
+
+def test_versao_fpdf():
+    # PDF (BufferSaida e modelos) e obter_imagem (_parsepng/_parsejpg) dependem de partes internas do fpdf 1.7.2
+    assert FPDF_VERSION == '1.7.2'
+
+def test_cabecalho_e_rodape_em_todas_as_paginas():
+    pdf_bytes = pg.gerar_pdf_matricula(livro_exemplo(), DADOS_ESCOLA, 'Livro de Matrículas')
+    paginas = conteudo_paginas(pdf_bytes)
+    assert len(paginas) > 2
+    # Parte fixa desenhada uma vez, nos modelos, e referenciada em cada página
+    modelos = conteudo_modelos(pdf_bytes)
+    assert sorted(modelos) == ['Cabecalho', 'Rodape']
+    assert 'Prefeitura Municipal de Campos dos Goytacazes' in modelos['Cabecalho']
+    assert '/I1 Do' in modelos['Cabecalho']  # brasão
+    assert 'Pedagogo Supervisor' in modelos['Rodape']
+    for conteudo in paginas:
+        assert '/TplCabecalho Do' in conteudo and '/TplRodape Do' in conteudo
+        assert 'Prefeitura Municipal de Campos dos Goytacazes' not in conteudo
+        assert 'Livro de Matr' in conteudo  # título, desenhado em cada página
+
+# Paginação pela altura das linhas
+
+def test_paginar_pela_altura_real():
+    # Cabeçalho (5) + 3 linhas de 10 enchem exatamente a página de 35
+    assert pg.paginar([10] * 5, 5, 35) == [(0, 3), (3, 5)]
+    # Linhas de alturas diferentes: a quebra depende da soma, não da quantidade
+    assert pg.paginar([8, 20, 8, 8, 4], 0, 30) == [(0, 2), (2, 5)]
+
+def test_paginar_linha_maior_que_a_pagina():
+    # Fica sozinha na página, sem página vazia antes ou depois
+    assert pg.paginar([5, 50, 5], 0, 30) == [(0, 1), (1, 2), (2, 3)]
+    assert pg.paginar([50], 10, 30) == [(0, 1)]
+
+def test_paginar_sem_linhas():
+    assert pg.paginar([], 5, 30) == []
+
+def test_linhas_altas_ocupam_mais_paginas():
+    curtos = livro_exemplo(80)
+    longos = curtos.assign(Nome=[f'ALUNO {i:04d} ' + 'SOBRENOME ' * 12 for i in range(80)])
+    paginas_curtos = len(conteudo_paginas(pg.gerar_pdf_matricula(curtos, DADOS_ESCOLA, 'Livro de Matrículas')))
+    paginas_longos = len(conteudo_paginas(pg.gerar_pdf_matricula(longos, DADOS_ESCOLA, 'Livro de Matrículas')))
+    assert paginas_longos > paginas_curtos
+
+def nomes_no_livro(pdf_bytes, nomes):
+    """Nomes (dentre `nomes`) na ordem em que aparecem no livro."""
+    return [
+        texto for conteudo in conteudo_paginas(pdf_bytes)
+        for texto in re.findall(r'\(([^()]*)\) Tj', conteudo) if texto in nomes
+    ]
+
+@pytest.mark.parametrize('invertido', [False, True])
+def test_deduplicacao_por_cpf_mantem_a_matricula_mais_nova(invertido):
+    df = pd.DataFrame({
+        'Nome': ['CARLA', 'ANA ANTIGA', 'BRUNO', 'ANA NOVA', 'DANI', 'EDU'],
+        'CPF': ['3', '1', '', '1', None, None],
+        'Data de Matrícula': pd.to_datetime(['2025-02-01', '2025-01-10', '2025-02-01', '2025-03-01', '2025-02-01', '2025-02-01']),
+        'Turma no Ano Selecionado': ['1A'] * 6
+    })
+    if invertido:
+        df = df.iloc[::-1].reset_index(drop=True)
+    pdf_bytes = pg.gerar_pdf_matricula(df, DADOS_ESCOLA, 'Livro de Matrículas')
+    # CPF repetido: fica só a matrícula mais nova; linhas sem CPF nunca são descartadas.
+    # A ordem do livro é a do nome, independente da ordem do arquivo.
+    assert nomes_no_livro(pdf_bytes, set(df['Nome'])) == ['ANA NOVA', 'BRUNO', 'CARLA', 'DANI', 'EDU']
+
+# Documento encadernado
+
+def textos_pagina(conteudo):
+    return re.findall(r'\(([^()]*)\) Tj', conteudo)
+
+def test_documento_encadernado():
+    df = livro_exemplo()
+    pdf_bytes = pg.gerar_documentos(df, DADOS_ESCOLA, encadernado=True)
+    separados = pg.gerar_documentos(df, DADOS_ESCOLA)
+    paginas = conteudo_paginas(pdf_bytes)
+    paginas_livro = conteudo_paginas(separados['livro'])
+    # Capa e abertura, livro e encerramento; o livro tem os mesmos textos do PDF separado
+    # (o estado de fonte e cores herdado de uma página para outra pode mudar)
+    assert len(paginas) == len(paginas_livro) + 3
+    assert [textos_pagina(c) for c in paginas[2:-1]] == [textos_pagina(c) for c in paginas_livro]
+    assert 'TERMO DE ABERTURA' in paginas[1] and 'TERMO DE ENCERRAMENTO' in paginas[-1]
+    # Capa e termos em retrato, sem o cabeçalho e o rodapé do livro
+    for conteudo in (paginas[0], paginas[1], paginas[-1]):
+        assert '/Tpl' not in conteudo
+    assert pdf_bytes.count(b'/MediaBox [0 0 595.28 841.89]') == 3
+    # Brasão gravado uma vez; modelos com a caixa da página do livro (paisagem)
+    assert pdf_bytes.count(b'/Subtype /Image') == 1
+    assert re.findall(rb'/BBox \[([^\]]*)\]', pdf_bytes) == [b'0 0 841.89 595.28'] * 2
+
+def test_buffer_saida_igual_ao_buffer_do_fpdf(monkeypatch):
+    df = livro_exemplo()
+    pdf_bytes = pg.gerar_pdf_matricula(df, DADOS_ESCOLA, 'Livro de Matrículas')
+    monkeypatch.setattr(pg, 'BufferSaida', str)  # buffer str original do fpdf
+    assert sem_data_criacao(pdf_bytes) == sem_data_criacao(pg.gerar_pdf_matricula(df, DADOS_ESCOLA, 'Livro de Matrículas'))
+
+def gravar_png_rgba(caminho, largura=4, altura=4):
+    """PNG RGBA simples (com canal alfa), escrito sem dependências."""
+    def bloco(tipo, dados):
+        return struct.pack('>I', len(dados)) + tipo + dados + struct.pack('>I', zlib.crc32(tipo + dados))
+    linhas = b''.join(b'\x00' + b'\xff\x00\x00\x80' * largura for _ in range(altura))
+    with open(caminho, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(bloco(b'IHDR', struct.pack('>IIBBBBB', largura, altura, 8, 6, 0, 0, 0)))
+        f.write(bloco(b'IDAT', zlib.compress(linhas)))
+        f.write(bloco(b'IEND', b''))
+
+def documento_com_imagem(caminho, usar_cache):
+    pdf = FPDF()
+    pdf.add_page()
+    if usar_cache:
+        pg.inserir_imagem(pdf, 10, 10, 20, 20, caminho)
+    else:
+        pdf.image(caminho, 10, 10, 20, 20)
+    return pg.pdf_em_bytes(pdf)
+
+def test_imagem_com_alfa_sobe_versao_do_pdf(tmp_path):
+    caminho = str(tmp_path / 'alfa.png')
+    gravar_png_rgba(caminho)
+    pdf_bytes = documento_com_imagem(caminho, usar_cache=True)
+    assert pdf_bytes.startswith(b'%PDF-1.4')
+    assert sem_data_criacao(pdf_bytes) == sem_data_criacao(documento_com_imagem(caminho, usar_cache=False))
+
+def test_cache_da_imagem_nao_e_alterado_pelos_documentos(tmp_path):
+    caminho = str(tmp_path / 'alfa.png')
+    gravar_png_rgba(caminho)
+    info, _ = pg.obter_imagem(caminho)
+    chaves = set(info)
+    primeiro = documento_com_imagem(caminho, usar_cache=True)
+    assert set(info) == chaves and 'n' not in info
+    assert sem_data_criacao(documento_com_imagem(caminho, usar_cache=True)) == sem_data_criacao(primeiro)
+
+# Gravação contínua
+
+def objetos_sem_data(pdf_bytes):
+    return {numero: sem_data_criacao(objeto) for numero, objeto in objetos_pdf(pdf_bytes).items()}
+
+def test_gravar_pdf_matricula(tmp_path):
+    df = livro_exemplo()
+    destino = str(tmp_path / 'livro.pdf')
+    assert pg.gravar_pdf_matricula(df, DADOS_ESCOLA, 'Livro de Matrículas', destino) == destino
+    assert [p.name for p in tmp_path.iterdir()] == ['livro.pdf']
+    with open(destino, 'rb') as f:
+        gravado = f.read()
+    assert gravado.startswith(b'%PDF-1.3\n') and gravado.rstrip().endswith(b'%%EOF')
+    # Os mesmos objetos do PDF montado em memória (no arquivo, o conteúdo das páginas vem antes dos dicionários)
+    assert objetos_sem_data(gravado) == objetos_sem_data(pg.gerar_pdf_matricula(df, DADOS_ESCOLA, 'Livro de Matrículas'))
+
+def test_gravacao_continua_libera_as_paginas(tmp_path):
+    with open(tmp_path / 'livro.pdf', 'wb') as arquivo:
+        pdf = pg.criar_livro(livro_exemplo(), DADOS_ESCOLA, 'Livro de Matrículas', arquivo)
+        # Só a página ainda aberta está em memória; as anteriores já foram para o arquivo
+        assert pdf.page > 2
+        assert all(conteudo == '' for n, conteudo in pdf.pages.items() if n < pdf.page)
+        assert arquivo.tell() > 0
+        pdf.close()
+
+def test_gravacao_continua_com_alias_links_e_versao(tmp_path):
+    imagem = str(tmp_path / 'alfa.png')
+    gravar_png_rgba(imagem)
+
+    def criar(arquivo=None):
+        pdf = pg.PDF('Livro de Matrículas', DADOS_ESCOLA, arquivo)
+        pdf.alias_nb_pages()
+        destino = pdf.add_link()
+        for pagina in range(1, 4):
+            pdf.add_page()
+            pdf.set_font('Arial', '', 8)
+            pdf.cell(40, 5, 'Sem total' if pagina == 2 else f'Página {pagina} de {{nb}}', link=destino)
+            pdf.cell(40, 5, 'Site', link='https://exemplo.org')
+        # Destino do link e imagem com transparência (PDF 1.4) definidos depois das primeiras páginas gravadas
+        pdf.set_link(destino, y=60, page=2)
+        pdf.image(imagem, 10, 10, 20, 20)
+        return pdf
+
+    destino = pg.gravar_pdf(criar, str(tmp_path / 'documento.pdf'))
+    with open(destino, 'rb') as f:
+        gravado = f.read()
+    assert gravado.startswith(b'%PDF-1.4\n')
+    assert objetos_sem_data(gravado) == objetos_sem_data(pg.pdf_em_bytes(criar()))
+    paginas = conteudo_paginas(gravado)
+    assert '(Página 1 de 3)' in paginas[0] and '(Sem total)' in paginas[1] and '(Página 3 de 3)' in paginas[2]
+    assert gravado.count(b'/Dest [5 0 R') == 3 and gravado.count(b'/URI (https://exemplo.org)') == 3
+
+def test_gravar_pdf_com_erro_nao_deixa_arquivo(tmp_path, monkeypatch):
+    def falhar(origem, destino):
+        assert os.path.exists(origem)  # temporário já gravado
+        raise OSError('disco cheio')
+    monkeypatch.setattr(pg.os, 'replace', falhar)
+    with pytest.raises(OSError):
+        pg.gravar_pdf_matricula(livro_exemplo(), DADOS_ESCOLA, 'Livro de Matrículas', str(tmp_path / 'livro.pdf'))
+    assert list(tmp_path.iterdir()) == []
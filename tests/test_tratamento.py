@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+import tratamento as tr
+
+def nomes(plano):
+    return [item['nome'] for item in plano]
+
+def situacoes(df):
+    return {registro['etapa']: registro['situacao'] for registro in df.attrs['metricas_tratamento']}
+
+# Conversão de datas
+
+def test_converter_datas_formato_do_suap():
+    datas, falhas = tr.converter_datas(pd.Series(['01/02/2010', '31/12/2011', None]))
+    assert datas.tolist()[:2] == [pd.Timestamp(2010, 2, 1), pd.Timestamp(2011, 12, 31)]
+    assert pd.isna(datas[2]) and falhas == 0
+
+def test_converter_datas_fallback():
+    # ISO 8601 (células de data do Excel) e, por último, o parser com dia primeiro
+    datas, falhas = tr.converter_datas(pd.Series(['01/02/2010', '2011-03-15', '2012-04-20 00:00:00', '15-03-2011']))
+    assert datas.tolist() == [
+        pd.Timestamp(2010, 2, 1), pd.Timestamp(2011, 3, 15), pd.Timestamp(2012, 4, 20), pd.Timestamp(2011, 3, 15)
+    ]
+    assert falhas == 0
+
+def test_converter_datas_conta_falhas():
+    # Só valores preenchidos contam como falha; vazios, espaços e nulos não
+    datas, falhas = tr.converter_datas(pd.Series(['01/02/2010', 'abc', '99/99/2010', '  ', None, np.nan]))
+    assert datas.isna().tolist() == [False, True, True, True, True, True]
+    assert falhas == 2
+
+def test_converter_datas_ja_convertidas():
+    serie = pd.Series(pd.to_datetime(['2010-02-01', None]))
+    datas, falhas = tr.converter_datas(serie)
+    assert datas is serie and falhas == 0
+
+def test_aviso_de_datas_nao_reconhecidas():
+    df = pd.DataFrame({'Data de Nascimento': ['01/02/2010', 'abc', 'xyz']})
+    resultado = tr.tratar_dados(df, 2025, None, ['Data de Nascimento'])
+    assert resultado.attrs['avisos_tratamento'] == {"data(s) não reconhecida(s) na coluna 'Data de Nascimento'.": 2}
+    assert tr.textos_avisos(resultado) == ["2 data(s) não reconhecida(s) na coluna 'Data de Nascimento'."]
+
+# Planejamento das etapas
+
+def test_planejar_todas_as_etapas():
+    assert tr.planejar_etapas(None, {'ano_letivo': 2025}) == tr.ETAPAS_TRATAMENTO
+
+def test_planejar_inclui_etapas_das_entradas():
+    plano = nomes(tr.planejar_etapas(['Idade em 31/03/2025'], {'ano_letivo': 2025}))
+    # A idade depende da conversão da data de nascimento; filtro e compactação sempre rodam
+    assert plano == [
+        'Filtro de ano da matrícula',
+        'Conversão de datas: Data de Nascimento',
+        'Idade em 31/03',
+        'Compactação de tipos'
+    ]
+
+def test_planejar_saidas_com_ano_letivo():
+    # 'Idade em 31/03/{ano_letivo}' só corresponde à coluna do ano do contexto
+    plano = nomes(tr.planejar_etapas(['Idade em 31/03/2024'], {'ano_letivo': 2025}))
+    assert plano == ['Filtro de ano da matrícula', 'Compactação de tipos']
+
+def test_planejar_cadeia_da_situacao():
+    plano = nomes(tr.planejar_etapas(['Data do Último Procedimento'], {'ano_letivo': 2025}))
+    assert plano == [
+        'Filtro de ano da matrícula',
+        'Conversão de datas: Data do Último Procedimento',
+        'DE-PARA (Grupo/Ano/Fase e Ordenador)',  # produz 'Descrição do Curso', lida pela etapa seguinte
+        'Situação da Educação Infantil',
+        'Texto da situação',
+        'Data da situação',
+        'Compactação de tipos'
+    ]
+
+# Execução
+
+def test_tratar_dados_executa_so_o_plano():
+    df = pd.DataFrame({'Matrícula': ['2025001', '2026001'], 'Data de Nascimento': ['01/02/2010', '31/03/2011']})
+    resultado = tr.tratar_dados(df, 2025, None, ['Idade em 31/03/2025'])
+    assert resultado['Matrícula'].tolist() == ['2025001']  # matrícula de ano posterior descartada
+    assert resultado['Idade em 31/03/2025'].tolist() == [15]
+
+    situacao = situacoes(resultado)
+    assert situacao['Idade em 31/03'] == 'executada'
+    assert situacao['Naturalidade (Município -> Município(UF))'] == 'não solicitada'
+    assert situacao['Conversão de datas: Data de Matrícula'] == 'não solicitada'
+
+def test_tratar_dados_pula_etapas_sem_entradas():
+    df = pd.DataFrame({'Nome': ['ANA'], 'Período no Ano Selecionado': ['1']})
+    resultado = tr.tratar_dados(df, 2025, None)
+    situacao = situacoes(resultado)
+    assert situacao['DE-PARA (Grupo/Ano/Fase e Ordenador)'] == 'entradas ausentes'
+    assert situacao['Idade em 31/03'] == 'entradas ausentes'
+    assert situacao['Pós Censo'] == 'executada'  # entrada opcional
+    assert resultado['Pós Censo'].tolist() == ['-']
+    # Só as etapas com aviso_ausente registram aviso
+    assert list(resultado.attrs['avisos_tratamento']) == [
+        "Colunas 'Descrição do Curso' e 'Período no Ano Selecionado' não encontradas para aplicação do DE-PARA."
+    ]
+
+def test_tratar_dados_depara():
+    df = pd.DataFrame({'Descrição do Curso': ['Educação Infantil'], 'Período no Ano Selecionado': ['4']})
+    resultado = tr.tratar_dados(df, 2025, None, ['Grupo/Ano/Fase'])
+    assert resultado['Grupo/Ano/Fase'].tolist() == ['P1']
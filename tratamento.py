@@ -0,0 +1,328 @@
+import threading
+import time
+from datetime import date
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from ingestao import coluna_texto_arrow, acumular_aviso
+from indice_municipios import obter_indice, tratar_naturalidade
+
+# Tratamento dos dados do SUAP para o livro (sem dependência do Streamlit, para ser
+# usado pela interface, pelo lote e pelos testes).
+
+# DEPARA.csv lido uma única vez por processo (cada chamada recebe uma cópia)
+ARQUIVO_DEPARA = "DEPARA.csv"
+_depara = None
+_trava_depara = threading.Lock()
+
+def carregar_depara():
+    global _depara
+    if _depara is None:
+        with _trava_depara:
+            if _depara is None:
+                _depara = pd.read_csv(ARQUIVO_DEPARA)
+    return _depara.copy()
+
+def como_texto(serie):
+    """astype(str) que mantém os nulos (senão viram os textos 'nan'/'None' no livro)."""
+    return serie.where(serie.isna(), serie.astype(str))
+
+def filtro_ano_matricula(matriculas, ano_ref):
+    """
+    Máscara das matrículas a manter: descarta as que começam (após trim) com um ano
+    de 4 dígitos maior que ano_ref. Nulos e valores curtos/não numéricos são mantidos.
+    Vetorizado com pyarrow.compute sobre a coluna inteira.
+    """
+    arr = coluna_texto_arrow(matriculas)
+    prefixo = pc.utf8_slice_codeunits(pc.utf8_trim_whitespace(arr), 0, 4)
+    prefixo_valido = pc.match_substring_regex(prefixo, r'^\d{4}$')
+    ano_mat = pc.cast(pc.if_else(prefixo_valido, prefixo, '0'), pa.int32())
+    descartar = pc.fill_null(pc.greater(ano_mat, int(ano_ref)), False)
+    return ~descartar.to_numpy(zero_copy_only=False)
+
+def converter_datas(serie):
+    """
+    Converte a coluna para datetime e retorna (datas, quantidade de falhas).
+    Usa o formato explícito DD/MM/AAAA do SUAP; os valores fora dele passam por
+    ISO 8601 (datas de células Excel) e, por último, pelo parser com dayfirst.
+    Falhas são valores preenchidos que não puderam ser convertidos (ficam NaT).
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie, 0
+
+    datas = pd.to_datetime(serie, format='%d/%m/%Y', errors='coerce')
+    for formato in ('ISO8601', 'mixed'):
+        pendentes = datas.isna() & serie.notna()
+        if not pendentes.any():
+            return datas, 0
+        datas[pendentes] = pd.to_datetime(serie[pendentes], format=formato, dayfirst=True, errors='coerce')
+
+    pendentes = datas.isna() & serie.notna()
+    falhas = int((serie[pendentes].astype(str).str.strip() != '').sum())
+    return datas, falhas
+
+def calcular_idade(nascimento, ano_ref):
+    """
+    Idade em 31/03 do ano de referência, calculada sobre a coluna inteira a partir de
+    ano/mês/dia da coluna datetime. Datas nulas resultam em NaN.
+    """
+    data_ref = date(int(ano_ref), 3, 31)
+    mes = nascimento.dt.month
+    dia = nascimento.dt.day
+    # Ainda não fez aniversário na data de referência
+    antes_aniversario = (mes > data_ref.month) | ((mes == data_ref.month) & (dia > data_ref.day))
+    return data_ref.year - nascimento.dt.year - antes_aniversario.astype(int)
+
+# Colunas com poucos valores distintos: armazenadas como category.
+# As demais colunas de texto usam strings em Arrow (string[pyarrow]).
+COLUNAS_CATEGORICAS = [
+    'Sexo',
+    'Situação no Ano Selecionado',
+    'Descrição do Curso',
+    'Período no Ano Selecionado',
+    'Turma no Ano Selecionado',
+    'Nacionalidade',
+    'Etnia/Raça',
+    'Grupo/Ano/Fase',
+    'Matriz',
+    'Curso',
+    'Deficiência, TEA, Altas Habilidades ou Superdotação',
+    'Pós Censo'
+]
+
+def compactar_tipos(df):
+    """Converte as colunas de texto do DataFrame tratado para category / string[pyarrow]."""
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        if col in COLUNAS_CATEGORICAS:
+            df[col] = df[col].astype('category')
+        else:
+            df[col] = df[col].astype('string[pyarrow]')
+    return df
+
+# Pipeline de tratamento
+# Cada etapa declara as colunas que lê (entradas obrigatórias e opcionais) e as que produz.
+# tratar_dados recebe as colunas desejadas e executa só as etapas necessárias para elas,
+# na ordem de registro. Para incluir uma nova coluna derivada basta registrar uma etapa.
+# Saídas podem usar {ano_letivo} (ex: 'Idade em 31/03/{ano_letivo}').
+ETAPAS_TRATAMENTO = []
+
+# Avisos das etapas não vão direto para a tela: CSVs grandes são tratados em blocos e o
+# mesmo aviso sairia uma vez por bloco. Eles ficam em {mensagem: quantidade} (somados entre
+# os blocos em concatenar_blocos) e são exibidos uma única vez por mostrar_avisos.
+def registrar_aviso(contexto, mensagem, quantidade=None):
+    acumular_aviso(contexto['avisos'], mensagem, quantidade)
+
+def textos_avisos(df):
+    """Avisos do tratamento já formatados (quantidade na frente, quando houver)."""
+    return [
+        f"{quantidade} {mensagem}" if quantidade else mensagem
+        for mensagem, quantidade in df.attrs.get('avisos_tratamento', {}).items()
+    ]
+
+def etapa(nome, entradas=(), opcionais=(), saidas=(), sempre=False, aviso_ausente=None):
+    """Registra uma etapa do tratamento. A função recebe (df, contexto) e devolve o df."""
+    def registrar(funcao):
+        ETAPAS_TRATAMENTO.append({
+            'nome': nome,
+            'funcao': funcao,
+            'entradas': tuple(entradas),
+            'opcionais': tuple(opcionais),
+            'saidas': tuple(saidas),
+            'sempre': sempre,
+            'aviso_ausente': aviso_ausente
+        })
+        return funcao
+    return registrar
+
+@etapa("Filtro de ano da matrícula", opcionais=["Matrícula"], sempre=True)
+def etapa_filtro_ano(df, contexto):
+    # Filtrar matrículas cujo ano inicia com valor superior ao ano letivo selecionado
+    if "Matrícula" in df.columns:
+        df = df[filtro_ano_matricula(df["Matrícula"], contexto['ano_letivo'])].reset_index(drop=True)
+    return df
+
+def converter_coluna_data(col):
+    """Etapa de conversão de uma coluna de data (formato DD/MM/AAAA, com fallback)."""
+    def converter(df, contexto):
+        # As colunas permanecem datetime; a formatação DD/MM/AAAA é feita só na geração do PDF.
+        df[col], falhas = converter_datas(df[col])
+        if falhas:
+            registrar_aviso(contexto, f"data(s) não reconhecida(s) na coluna '{col}'.", falhas)
+        return df
+    return converter
+
+for _col_data in ["Data de Matrícula", "Data do Último Procedimento", "Data de Nascimento"]:
+    etapa(f"Conversão de datas: {_col_data}", entradas=[_col_data], saidas=[_col_data])(converter_coluna_data(_col_data))
+
+@etapa("Idade em 31/03", entradas=["Data de Nascimento"], saidas=["Idade em 31/03/{ano_letivo}"])
+def etapa_idade(df, contexto):
+    ano_letivo_ref = contexto['ano_letivo']
+    df[f"Idade em 31/03/{ano_letivo_ref}"] = calcular_idade(df["Data de Nascimento"], ano_letivo_ref)
+    return df
+
+@etapa(
+    "DE-PARA (Grupo/Ano/Fase e Ordenador)",
+    entradas=["Descrição do Curso", "Período no Ano Selecionado"],
+    saidas=["Grupo/Ano/Fase", "Ordenador", "Descrição do Curso", "Período no Ano Selecionado"],
+    aviso_ausente="Colunas 'Descrição do Curso' e 'Período no Ano Selecionado' não encontradas para aplicação do DE-PARA."
+)
+def etapa_depara(df, contexto):
+    try:
+        df_depara = carregar_depara()
+    except Exception as e:
+        registrar_aviso(contexto, f"Erro ao carregar DEPARA.csv: {e}")
+        return df
+    # Chaves para o merge
+    chaves = ["Descrição do Curso", "Período no Ano Selecionado"]
+    # O DEPARA tem Período como int; ambos os lados são convertidos para string para o merge
+    df["Descrição do Curso"] = como_texto(df["Descrição do Curso"])
+    df["Período no Ano Selecionado"] = como_texto(df["Período no Ano Selecionado"])
+
+    df_depara["Descrição do Curso"] = df_depara["Descrição do Curso"].astype(str)
+    df_depara["Período no Ano Selecionado"] = df_depara["Período no Ano Selecionado"].astype(str)
+
+    # Merge Left para manter dados originais
+    return pd.merge(df, df_depara, on=chaves, how="left")
+
+@etapa("Naturalidade (Município -> Município(UF))", entradas=["Naturalidade"], saidas=["Naturalidade"])
+def etapa_naturalidade(df, contexto):
+    # Índice de municípios (montado uma vez por processo)
+    try:
+        indice_muni = obter_indice()
+    except Exception as e:
+        registrar_aviso(contexto, f"Não foi possível carregar municipios.csv: {e}")
+        indice_muni = None
+    df['Naturalidade'] = tratar_naturalidade(df['Naturalidade'], indice_muni)
+    return df
+
+@etapa(
+    "Necessidades especiais (PNE)",
+    opcionais=['Deficiência', 'Superdotação', 'Transtorno'],
+    saidas=['Deficiência, TEA, Altas Habilidades ou Superdotação']
+)
+def etapa_pne(df, contexto):
+    # "Sim" se alguma das colunas tiver valor não nulo e diferente de '-' (máscaras combinadas por coluna)
+    possui_necessidade = np.zeros(len(df), dtype=bool)
+    for col in ['Deficiência', 'Superdotação', 'Transtorno']:
+        if col in df.columns:
+            valores = coluna_texto_arrow(df[col])
+            preenchido = pc.and_kleene(pc.is_valid(valores), pc.not_equal(pc.utf8_trim_whitespace(valores), '-'))
+            possui_necessidade |= pc.fill_null(preenchido, False).to_numpy(zero_copy_only=False)
+
+    df['Deficiência, TEA, Altas Habilidades ou Superdotação'] = np.where(possui_necessidade, "Sim", "-")
+    return df
+
+@etapa(
+    "Situação da Educação Infantil",
+    entradas=['Descrição do Curso', 'Situação no Ano Selecionado'],
+    saidas=['Descrição do Curso', 'Situação no Ano Selecionado']
+)
+def etapa_situacao_infantil(df, contexto):
+    # Se "Descrição do Curso" == "Educação Infantil" AND "Situação no Ano Selecionado" == "Aprovado" -> "Sem Movimentação"
+    # Se "Descrição do Curso" == "Educação Infantil" AND "Situação no Ano Selecionado" == "Reprovado" -> "Ajuste de Idade"
+    # Normalizar strings para comparação segura
+    df['Descrição do Curso'] = como_texto(df['Descrição do Curso']).str.strip()
+    df['Situação no Ano Selecionado'] = como_texto(df['Situação no Ano Selecionado']).str.strip()
+
+    mask_infantil = df['Descrição do Curso'] == 'Educação Infantil'
+    mask_aprovado = df['Situação no Ano Selecionado'] == 'Aprovado'
+    mask_reprovado = df['Situação no Ano Selecionado'] == 'Reprovado'
+
+    df.loc[mask_infantil & mask_aprovado, 'Situação no Ano Selecionado'] = 'Sem Movimentação'
+    df.loc[mask_infantil & mask_reprovado, 'Situação no Ano Selecionado'] = 'Ajuste de Idade'
+    return df
+
+@etapa("Texto da situação", entradas=['Situação no Ano Selecionado'], saidas=['Situação no Ano Selecionado'])
+def etapa_texto_situacao(df, contexto):
+    # Substituição específica solicitada: "Aprovado com Progressão Parcial" -> "Aprovado com Prog. Parcial"
+    situacao = df['Situação no Ano Selecionado'].replace(
+        "Aprovado com Progressão Parcial", "Aprovado com Prog. Parcial"
+    )
+    # Limpar espaços em branco da coluna Situação
+    df['Situação no Ano Selecionado'] = como_texto(situacao).str.strip()
+    return df
+
+@etapa(
+    "Data da situação",
+    entradas=['Situação no Ano Selecionado', 'Data do Último Procedimento'],
+    saidas=['Data do Último Procedimento']
+)
+def etapa_data_situacao(df, contexto):
+    # Mostrar data apenas se Situação for "Transferido" ou "Transf. Externa"
+    mask_transferido = df['Situação no Ano Selecionado'].isin(['Transferido', 'Transf. Externa'])
+    # Sem data (NaT) nos demais casos; exibido como '-' no PDF
+    df['Data do Último Procedimento'] = df['Data do Último Procedimento'].where(mask_transferido)
+    return df
+
+@etapa("Pós Censo", opcionais=["Data de Matrícula"], saidas=["Pós Censo"])
+def etapa_pos_censo(df, contexto):
+    # Preenchido com "Sim" se 'Data de Matrícula' for igual ou superior a 'Data de referência do Censo Escolar'
+    data_censo_ref = contexto['data_censo']
+    if "Data de Matrícula" in df.columns and data_censo_ref:
+        try:
+            # Garantir que data_censo_ref seja Timestamp para comparação
+            censo_ts = pd.Timestamp(data_censo_ref)
+
+            # Comparação com NaT é False, então datas inválidas ficam "-"
+            df['Pós Censo'] = np.where(df['Data de Matrícula'] >= censo_ts, "Sim", "-")
+        except Exception as e:
+            registrar_aviso(contexto, f"Erro ao calcular Pós Censo: {e}")
+            df['Pós Censo'] = "-"
+    else:
+        df['Pós Censo'] = "-"
+    return df
+
+@etapa("Compactação de tipos", sempre=True)
+def etapa_compactar(df, contexto):
+    return compactar_tipos(df)
+
+def planejar_etapas(colunas, contexto):
+    """
+    Etapas necessárias para produzir `colunas` (None = todas), na ordem de registro.
+    Percorre o registro de trás para frente: uma etapa entra no plano se for obrigatória
+    ou produzir alguma coluna pendente, e suas entradas passam a ser pendentes.
+    """
+    if colunas is None:
+        return list(ETAPAS_TRATAMENTO)
+    pendentes = set(colunas)
+    plano = []
+    for item in reversed(ETAPAS_TRATAMENTO):
+        saidas = {s.format(**contexto) for s in item['saidas']}
+        if item['sempre'] or saidas & pendentes:
+            plano.append(item)
+            pendentes.update(item['entradas'])
+            pendentes.update(item['opcionais'])
+    plano.reverse()
+    return plano
+
+def tratar_dados(df, ano_letivo_ref, data_censo_ref, colunas=None):
+    """
+    Executa as etapas do tratamento necessárias para `colunas` (None = todas).
+    Etapas sem as colunas de entrada são puladas. O tempo e as linhas processadas
+    de cada etapa ficam em df.attrs['metricas_tratamento'] e os avisos em df.attrs['avisos_tratamento'].
+    """
+    contexto = {'ano_letivo': ano_letivo_ref, 'data_censo': data_censo_ref, 'avisos': {}}
+    plano = planejar_etapas(colunas, contexto)
+    metricas = []
+    for item in ETAPAS_TRATAMENTO:
+        registro = {'etapa': item['nome'], 'situacao': 'não solicitada', 'segundos': 0.0, 'linhas': 0}
+        metricas.append(registro)
+        if not any(item is p for p in plano):
+            continue
+        if not all(col in df.columns for col in item['entradas']):
+            registro['situacao'] = 'entradas ausentes'
+            if item['aviso_ausente']:
+                registrar_aviso(contexto, item['aviso_ausente'])
+            continue
+        registro['linhas'] = len(df)
+        inicio = time.perf_counter()
+        df = item['funcao'](df, contexto)
+        registro['segundos'] = time.perf_counter() - inicio
+        registro['situacao'] = 'executada'
+
+    df.attrs['metricas_tratamento'] = metricas
+    df.attrs['avisos_tratamento'] = contexto['avisos']
+    return df